@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
+import pathlib
+
 import click
+import orjson
 import uvicorn
 import uvicorn.logging
 
+from src import auth
+from src import bench
+
 
 @click.group()
 def cli() -> None:
@@ -17,5 +23,75 @@ def dev() -> None:
     )
 
 
+@cli.command("hash-password")
+@click.password_option()
+def hash_password(password: str) -> None:
+    """Hash the password for the `users` config."""
+    click.echo(auth.hash_password(password))
+
+
+@cli.command("bench")
+@click.option("--sizes", default="1KB,1MB,10MB", show_default=True, help="The state sizes.")
+@click.option("--requests", default=200, show_default=True, help="The requests per state size.")
+@click.option("--concurrency", default=8, show_default=True, help="The concurrent clients.")
+@click.option("--mix", default="get=70,post=25,lock=5", show_default=True, help="The mix weights.")
+@click.option("--latency", default=5.0, show_default=True, help="The backend latency in ms.")
+@click.option("--jitter", default=2.0, show_default=True, help="The backend latency jitter in ms.")
+@click.option("--chunking", is_flag=True, help="Store the states as content-defined chunks.")
+@click.option("--seed", default=0, show_default=True, help="The random seed.")
+@click.option("--output", type=click.Path(path_type=pathlib.Path), help="The JSON results file.")
+def bench_(  # noqa: PLR0913, PLR0917
+    sizes: str,
+    requests: int,
+    concurrency: int,
+    mix: str,
+    latency: float,
+    jitter: float,
+    chunking: bool,  # noqa: FBT001
+    seed: int,
+    output: pathlib.Path | None,
+) -> None:
+    """Benchmark the server with the in-memory backends."""
+    try:
+        weights = {op: int(w) for op, _, w in (item.partition("=") for item in mix.split(","))}
+        params = bench.Params(
+            sizes=tuple(bench.parse_size(size) for size in sizes.split(",")),
+            requests=requests,
+            concurrency=concurrency,
+            mix=weights,
+            latency=latency / 1000,
+            jitter=jitter / 1000,
+            chunking=chunking,
+            seed=seed,
+        )
+    except ValueError as err:
+        raise click.BadParameter(str(err)) from err
+    if unknown := set(params.mix) - set(bench.OPERATIONS):
+        raise click.BadParameter(f"Unknown operations: {', '.join(sorted(unknown))}.")
+
+    results = bench.run(params)
+    for result in results["results"]:
+        click.echo(
+            f"size={result['size']} rps={result['throughput_rps']} "
+            f"errors={result['errors']} peak_rss_mb={result['peak_rss_mb']}"
+        )
+        for op, stats in result["ops"].items():
+            click.echo(
+                f"  {op:<8} n={stats['count']} p50_ms={stats['p50_ms']} "
+                f"p90_ms={stats['p90_ms']} p99_ms={stats['p99_ms']} max_ms={stats['max_ms']}"
+            )
+    if output:
+        output.write_bytes(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+
+
+@cli.command("bench-compare")
+@click.argument("old", type=click.Path(exists=True, path_type=pathlib.Path))
+@click.argument("new", type=click.Path(exists=True, path_type=pathlib.Path))
+def bench_compare(old: pathlib.Path, new: pathlib.Path) -> None:
+    """Compare the NEW benchmark results with the OLD ones."""
+    for line in bench.compare(orjson.loads(old.read_bytes()), orjson.loads(new.read_bytes())):
+        click.echo(line)
+
+
 if __name__ == "__main__":
     cli()
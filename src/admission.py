@@ -0,0 +1,210 @@
+"""
+The admission control of the state payloads.
+
+Every state read or write holds its payload in memory several times (the body,
+the decoded document, the response), so a burst of concurrent large requests
+can exhaust the worker memory. The :class:`Limiter` bounds the total bytes of
+the in-flight payloads of a worker: a request waits in a FIFO queue until its
+payload fits into the budget, and is rejected when it does not fit in time.
+It also bounds the number of concurrent requests of a single client, so a
+single client cannot take the whole budget. The work a request leaves behind
+(e.g. the state projections) holds the request budget until it is done.
+"""
+
+import asyncio
+import collections
+import contextlib
+import typing
+
+import lazy_object_proxy
+
+from src import errors
+from src import log
+from src.config import config
+
+__all__ = ["default", "Limiter", "Ticket", "Error", "Overloaded", "ClientLimitExceeded"]
+
+LOG = log.get_logger(__name__)
+
+
+class Error(errors.Error):
+    """The admission control error."""
+
+    def __init__(self, msg: str, retry_after: float = 1.0) -> None:
+        """
+        :param retry_after: The number of seconds after which the request may be admitted.
+        """
+        self.retry_after = retry_after
+        super().__init__(msg)
+
+
+class Overloaded(Error):
+    """Raised when the payload does not fit into the budget in time."""
+
+
+class ClientLimitExceeded(Error):
+    """Raised when the client has too many requests in flight."""
+
+
+class Ticket:
+    """The admitted request, holding its share of the budget."""
+
+    def __init__(self, limiter: "Limiter") -> None:
+        self._limiter = limiter
+        self.nbytes = 0
+        self.task: asyncio.Task[None] | None = None
+
+    async def grow(self, nbytes: int) -> None:
+        """Acquire `nbytes` more of the budget, e.g. once the payload size is known.
+
+        :raises :class:`Overloaded`
+        """
+        nbytes = await self._limiter.acquire(nbytes)
+        self.nbytes += nbytes
+
+    async def resize(self, nbytes: int) -> None:
+        """Hold `nbytes` of the budget, e.g. once the estimated payload size is known.
+
+        :raises :class:`Overloaded`
+        """
+        if self._limiter.budget:
+            nbytes = min(nbytes, self._limiter.budget)
+        if nbytes > self.nbytes:
+            await self.grow(nbytes - self.nbytes)
+        elif nbytes < self.nbytes:
+            self._limiter._release(self.nbytes - nbytes)  # noqa: SLF001
+            self.nbytes = nbytes
+
+    def spawn(self, coro: typing.Coroutine[typing.Any, typing.Any, None]) -> None:
+        """Run the `coro` in a background task, the request stays admitted until it is done."""
+        if self.task is not None:
+            raise RuntimeError("The ticket already has a background task.")
+        self.task = asyncio.create_task(coro)
+
+
+class Limiter:
+    """
+    The in-flight payload bytes limiter of a worker.
+
+    :param budget: The maximum total bytes of the in-flight payloads, `0` disables.
+        A payload larger than the budget is admitted alone.
+    :param queue_timeout: The number of seconds a request waits for the budget.
+    :param client_limit: The maximum number of in-flight requests per client, `0` disables.
+    """
+
+    def __init__(self, budget: int, queue_timeout: float, client_limit: int) -> None:
+        self.budget = budget
+        self.queue_timeout = queue_timeout
+        self.client_limit = client_limit
+        self._available = budget
+        self._waiters: collections.deque[tuple[int, asyncio.Future[None]]] = collections.deque()
+        self._clients: collections.Counter[str] = collections.Counter()
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    @property
+    def in_flight(self) -> int:
+        """The bytes of the in-flight payloads."""
+        return self.budget - self._available
+
+    async def drain(self) -> None:
+        """Wait for the background tasks of the admitted requests to finish."""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    @contextlib.asynccontextmanager
+    async def admit(self, client: str, nbytes: int = 0) -> typing.AsyncIterator[Ticket]:
+        """Admit the request of the `client` with the payload of `nbytes`.
+
+        :raises :class:`ClientLimitExceeded`
+        :raises :class:`Overloaded`
+        """
+        if self.client_limit and self._clients[client] >= self.client_limit:
+            raise ClientLimitExceeded(
+                f"The client has {self.client_limit} requests in flight.",
+                retry_after=self.queue_timeout,
+            )
+        self._clients[client] += 1
+        ticket = Ticket(self)
+
+        def release(task: asyncio.Task[None] | None = None) -> None:
+            self._tasks.discard(task)  # type: ignore[arg-type]
+            if task is not None and not task.cancelled() and task.exception() is not None:
+                LOG.error("The background task failed.", exc_info=task.exception())
+            self._release(ticket.nbytes)
+            self._clients[client] -= 1
+            if not self._clients[client]:
+                del self._clients[client]
+
+        try:
+            await ticket.grow(nbytes)
+            yield ticket
+        finally:
+            if ticket.task is None:
+                release()
+            else:
+                self._tasks.add(ticket.task)
+                ticket.task.add_done_callback(release)
+
+    async def acquire(self, nbytes: int) -> int:
+        """Wait until `nbytes` of the budget are available and take them.
+
+        :raises :class:`Overloaded`
+        :return: The number of the taken bytes.
+        """
+        if not self.budget or nbytes <= 0:
+            return 0
+        nbytes = min(nbytes, self.budget)
+        if not self._waiters and nbytes <= self._available:
+            self._available -= nbytes
+            return nbytes
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(entry := (nbytes, waiter))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except TimeoutError:
+            if waiter.done():
+                # Admitted just in time.
+                return nbytes
+            self._waiters.remove(entry)
+            self._wake()
+            LOG.warning("Rejected the request over the budget.", nbytes=nbytes, queued=len(self))
+            raise Overloaded(
+                "The server is overloaded, the request payload does not fit into the budget.",
+                retry_after=self.queue_timeout,
+            )
+        except asyncio.CancelledError:
+            # The client has gone, give back the budget or the place in the queue.
+            if waiter.done():
+                self._release(nbytes)
+            else:
+                self._waiters.remove(entry)
+                self._wake()
+            raise
+        return nbytes
+
+    def __len__(self) -> int:
+        """The number of the queued requests."""
+        return len(self._waiters)
+
+    def _release(self, nbytes: int) -> None:
+        self._available += nbytes
+        self._wake()
+
+    def _wake(self) -> None:
+        """Admit the queued requests in order, while they fit into the budget."""
+        while self._waiters and self._waiters[0][0] <= self._available:
+            nbytes, waiter = self._waiters.popleft()
+            self._available -= nbytes
+            waiter.set_result(None)
+
+
+def create_default_limiter() -> Limiter:
+    """Create the default limiter."""
+    return Limiter(
+        config.admission_budget, config.admission_queue_timeout, config.admission_client_limit
+    )
+
+
+default: Limiter = lazy_object_proxy.Proxy(create_default_limiter)
+"""Default limiter instance (lazy object)."""
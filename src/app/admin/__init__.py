@@ -0,0 +1,3 @@
+from . import api
+
+__all__ = ["api"]
@@ -0,0 +1,98 @@
+"""The admin API routes."""
+
+import typing
+
+from fastapi import APIRouter
+from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from src import auth
+from src import log
+from src import profiling
+
+LOG = log.get_logger(__name__)
+
+router = APIRouter(prefix="/admin")
+
+Seconds = typing.Annotated[float, Query(gt=0, le=300)]
+
+
+def _authorize(request: Request) -> None:
+    """Check the user authenticated by the :class:`StateAuthnMiddleware` is an admin."""
+    user: auth.User | None = getattr(request.state, "user", None)
+    if user is None or not user.is_admin:
+        raise HTTPException(
+            403, detail="Forbidden. The profiling requires access to all the states."
+        )
+
+
+@router.get("/profile/cpu", response_class=PlainTextResponse)
+async def profile_cpu(
+    request: Request,
+    seconds: Seconds = 10,
+    interval: typing.Annotated[float, Query(ge=0.001, le=1)] = 0.01,
+    idle: bool = False,  # noqa: FBT001, FBT002
+) -> PlainTextResponse:
+    """
+    Sample the stacks of all the worker threads for the given number of seconds.
+
+    The profile is returned as collapsed stacks, one `thread;frame;...;frame count`
+    per line, e.g. for `flamegraph.pl` or speedscope. The threads waiting for work
+    are skipped, unless `idle` is set.
+    """
+    _authorize(request)
+    LOG.info("Profiling CPU...", seconds=seconds)
+    try:
+        counts = await run_in_threadpool(profiling.sample_stacks, seconds, interval, idle)
+    except profiling.Busy as err:
+        raise HTTPException(409, detail=str(err))
+    return PlainTextResponse(profiling.collapse(counts))
+
+
+@router.get("/profile/memory")
+async def profile_memory(
+    request: Request,
+    seconds: Seconds = 10,
+    limit: typing.Annotated[int, Query(ge=1, le=1000)] = 20,
+    frames: typing.Annotated[int, Query(ge=1, le=100)] = 1,
+    group_by: typing.Literal["filename", "lineno", "traceback"] = "lineno",
+) -> list[profiling.Allocation]:
+    """
+    Trace the allocations for the given number of seconds.
+
+    Returns the top allocating code locations by the allocated size change
+    between the `tracemalloc` snapshots taken at the start and the end.
+    """
+    _authorize(request)
+    LOG.info("Profiling memory...", seconds=seconds)
+    try:
+        return await run_in_threadpool(
+            profiling.trace_allocations, seconds, limit, frames, group_by
+        )
+    except profiling.Busy as err:
+        raise HTTPException(409, detail=str(err))
+
+
+@router.get("/profile/loop")
+async def profile_loop(
+    request: Request,
+    seconds: Seconds = 10,
+    interval: typing.Annotated[float, Query(ge=0.001, le=1)] = 0.05,
+    threshold: typing.Annotated[float, Query(ge=0.001, le=60)] = 0.1,
+) -> profiling.LoopReport:
+    """
+    Monitor the event loop lag for the given number of seconds.
+
+    Returns how late the scheduled callbacks run, and the callbacks blocking
+    the event loop for longer than the `threshold`, with the stack captured
+    while they were running.
+    """
+    _authorize(request)
+    LOG.info("Profiling event loop...", seconds=seconds)
+    try:
+        return await profiling.monitor_loop(seconds, interval, threshold)
+    except profiling.Busy as err:
+        raise HTTPException(409, detail=str(err))
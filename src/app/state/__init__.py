@@ -1,5 +1,7 @@
 from . import api
+from . import delta
+from . import history
 from . import service
 from . import types
 
-__all__ = ["api", "types", "service"]
+__all__ = ["api", "delta", "history", "types", "service"]
@@ -1,51 +1,144 @@
 """The HTTP state API routes."""
 
+import asyncio
+import contextlib
+import functools
 import typing
 
 import orjson
 import pydantic_core
 from fastapi import APIRouter
 from fastapi import HTTPException
+from fastapi import Query
 from fastapi import Request
 from fastapi import status
 from fastapi.responses import JSONResponse
 from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
 
+from src import admission
+from src import auth
 from src import lock
 from src import log
 from src import storage
+from src.config import config
 
+from . import catalog
+from . import history
+from . import index
+from . import outputs
 from . import service
 from . import types
 
 LOG = log.get_logger(__name__)
 
-router = APIRouter(prefix="/state")
+router = APIRouter()
 
+_projections: dict[str, asyncio.Task[None]] = {}
+"""The last state projections task by the state ID."""
 
-@router.post("/lock/{state_id:path}", name="path-convertor", status_code=status.HTTP_200_OK)
-async def lock_state(state_id: str, lock_info: types.LockInfo) -> Response:
+
+def _unavailable(backend: str, err: storage.Unavailable | lock.Unavailable) -> HTTPException:
+    """Build the 503 error for a timed out or failing fast backend."""
+    return HTTPException(
+        503,
+        detail=f"The {backend} backend is temporarily unavailable.",
+        headers={"Retry-After": str(max(round(err.retry_after), 1))},
+    )
+
+
+def _rebuilding(err: catalog.Rebuilding) -> HTTPException:
+    """Build the 503 error for a catalog read while the catalog is rebuilt."""
+    return HTTPException(503, detail=str(err), headers={"Retry-After": "10"})
+
+
+def _overloaded(err: admission.Error) -> HTTPException:
+    """Build the 429 or 503 error for a request which is not admitted."""
+    return HTTPException(
+        429 if isinstance(err, admission.ClientLimitExceeded) else 503,
+        detail=str(err),
+        headers={"Retry-After": str(max(round(err.retry_after), 1))},
+    )
+
+
+@contextlib.contextmanager
+def _storage_errors(state_id: str | None = None) -> typing.Iterator[None]:
+    """Map the storage backend errors to the HTTP errors.
+
+    :param state_id: The state reported as not found (404) on :class:`storage.NotFound`.
+    """
+    try:
+        yield
+    except storage.Unavailable as err:
+        LOG.error("The storage backend is unavailable. %s", str(err))
+        raise _unavailable(f"{storage.default.name} storage", err)
+    except storage.Error as err:
+        if state_id is not None and isinstance(err, storage.NotFound):
+            LOG.debug("The storage backend not found error. %s", str(err))
+            raise HTTPException(404, detail=f"The state with ID {state_id} not found.")
+        LOG.debug("The storage backend error. %s", str(err))
+        raise HTTPException(
+            502, detail=f"Failed to access the {storage.default.name} storage backend."
+        )
+
+
+def _user(request: Request) -> auth.User:
+    """The user authenticated by the :class:`StateAuthnMiddleware`."""
+    user: auth.User | None = getattr(request.state, "user", None)
+    if user is None:
+        raise HTTPException(403, detail="Forbidden. The request is not authenticated.")
+    return user
+
+
+def _authorize(request: Request, state_id: str) -> None:
+    """Check the state ID is valid, and the authenticated user has access to the state."""
+    if not catalog.is_state(state_id):
+        raise HTTPException(
+            400, detail=f"The state ID {state_id} is reserved for the derived state objects."
+        )
+    if not _user(request).can_access(state_id):
+        raise HTTPException(403, detail=f"Forbidden. No access to the state with ID {state_id}.")
+
+
+def _client(request: Request) -> str:
+    """The client the admission limits are applied to, the authenticated user.
+
+    The client address is not used, behind a load balancer it is the same for all the clients.
+    """
+    return _user(request).name
+
+
+@router.post("/state/lock/{state_id:path}", name="path-convertor", status_code=status.HTTP_200_OK)
+async def lock_state(state_id: str, lock_info: types.LockInfo, request: Request) -> Response:
     """
     Lock the state by its ID.
 
     The endpoint will return a 423: Locked or 409: Conflict with
     the holding lock info when it's already taken, 200: OK for success.
     """
+    _authorize(request, state_id)
     try:
-        lock.default.lock(
-            state_id, lock_info_dict := typing.cast(lock.LockInfo, lock_info.model_dump())
+        await run_in_threadpool(
+            lock.default.lock,
+            state_id,
+            lock_info_dict := typing.cast(lock.LockInfo, lock_info.model_dump()),
         )
     except lock.AlreadyLocked as err:
         LOG.warning("The lock backend error. %s", str(err), lock_info=lock_info)
         return JSONResponse(err.lock_info, status_code=409)
+    except lock.Unavailable as err:
+        LOG.error("The lock backend is unavailable. %s", str(err))
+        raise _unavailable(f"{lock.default.name} lock", err)
     except lock.Error as err:
         LOG.error("The lock backend error. %s", str(err))
         raise HTTPException(502, detail=f"Failed to access the {lock.default.name} lock backend.")
     LOG.info("Locked the state.", state_id=state_id, lock_info=lock_info_dict)
+    # The lock and unlock updates are applied in order, not to leave a stale lock holder.
+    await run_in_threadpool(_update_catalog, catalog.default.lock, state_id, lock_info_dict)
     return Response(status_code=200)
 
 
-@router.post("/unlock/{state_id:path}", name="path-convertor", status_code=status.HTTP_200_OK)
+@router.post("/state/unlock/{state_id:path}", name="path-convertor", status_code=status.HTTP_200_OK)
 async def unlock_state(state_id: str, request: Request) -> None:
     """
     Unlock the state by its ID.
@@ -60,34 +153,285 @@ async def unlock_state(state_id: str, request: Request) -> None:
     The endpoint will return a 423: Locked or 409: Conflict with
     the holding lock info when it's already taken, 200: OK for success.
     """
+    _authorize(request, state_id)
     try:
-        lock_info_dict = lock.default.unlock(state_id)
+        lock_info_dict = await run_in_threadpool(lock.default.unlock, state_id)
     except lock.NotLocked as err:
         LOG.warning("The lock backend error. %s", str(err))
         raise HTTPException(409, detail=f"State with ID {state_id} is not locked.")
+    except lock.Unavailable as err:
+        LOG.error("The lock backend is unavailable. %s", str(err))
+        raise _unavailable(f"{lock.default.name} lock", err)
     except lock.Error as err:
         LOG.error("The lock backend error. %s", str(err))
         raise HTTPException(502, detail=f"Failed to access the {lock.default.name} lock backend.")
 
     lock_info = types.LockInfo(**lock_info_dict)  # type: ignore
     LOG.info("Removed lock from the state.", state_id=state_id, **lock_info.model_dump())
+    await run_in_threadpool(_update_catalog, catalog.default.unlock, state_id)
 
 
-@router.get("/{state_id:path}", name="path-convertor")
-async def get_state(state_id: str) -> types.TerraformState:
-    """Fetch the state by its ID."""
-    LOG.info("Fetching state...", state_id=state_id)
+@router.get("/catalog")
+async def list_states(
+    request: Request,
+    prefix: str = "",
+    after: str | None = None,
+    limit: typing.Annotated[int, Query(ge=1, le=1000)] = 100,
+) -> types.StateList:
+    """
+    List the states with IDs starting with the `prefix`, ordered by ID.
 
+    The states are listed from the states catalog, without reading the states.
+    The next page is fetched by passing the returned `next` cursor as `after`.
+    Only the states the user has access to are listed.
+    """
+    user = _user(request)
     try:
-        body = storage.default.get(state_id)
-    except storage.NotFound as err:
-        LOG.debug("The storage backend not found error. %s", str(err))
+        with _storage_errors():
+            states, next_ = await run_in_threadpool(
+                catalog.default.list_states, prefix, after, limit, user.can_access
+            )
+    except catalog.Rebuilding as err:
+        raise _rebuilding(err)
+    return types.StateList(states=states, next=next_)
+
+
+@router.post("/admin/catalog/rebuild")
+async def rebuild_catalog(request: Request) -> dict[str, int]:
+    """
+    Rebuild the states catalog by reading all the states from the storage.
+
+    With the chunked storage, the chunks no longer referenced by any state
+    are deleted in the same pass.
+    """
+    if not _user(request).is_admin:
+        raise HTTPException(403, detail="Forbidden. The rebuild requires access to all the states.")
+    with _storage_errors():
+        result = {"states": await run_in_threadpool(catalog.default.rebuild)}
+        if isinstance(backend := storage.default, storage.ChunkedStorageBackend):
+            result["chunks"] = await run_in_threadpool(backend.collect_garbage)
+    return result
+
+
+@router.get("/catalog/{state_id:path}", name="path-convertor")
+async def get_state_meta(state_id: str, request: Request) -> types.StateEntry:
+    """Fetch the catalog entry of the state by its ID."""
+    _authorize(request, state_id)
+    try:
+        with _storage_errors():
+            entry = await run_in_threadpool(catalog.default.get, state_id)
+    except catalog.Rebuilding as err:
+        raise _rebuilding(err)
+    if entry is None:
         raise HTTPException(404, detail=f"The state with ID {state_id} not found.")
+    return entry
+
+
+@router.get("/versions/{state_id:path}", name="path-convertor")
+async def list_state_versions(state_id: str, request: Request) -> list[types.StateVersion]:
+    """List the recorded versions of the state by its ID, oldest first."""
+    _authorize(request, state_id)
+    with _storage_errors():
+        return await run_in_threadpool(history.list_versions, state_id)
+
+
+@router.get(
+    "/version/{serial}/{state_id:path}",
+    name="path-convertor",
+    response_model=types.TerraformState,
+    response_class=Response,
+)
+async def get_state_version(serial: int, state_id: str, request: Request) -> Response:
+    """Fetch the state by its ID as it was at the given serial."""
+    _authorize(request, state_id)
+    LOG.info("Fetching state version...", state_id=state_id, serial=serial)
+
+    try:
+        async with admission.default.admit(_client(request), await _state_size(state_id)):
+            with _storage_errors():
+                try:
+                    data = await run_in_threadpool(history.get_version, state_id, serial)
+                except history.NotFound as err:
+                    LOG.debug("The state version not found error. %s", str(err))
+                    raise HTTPException(
+                        404, detail=f"The state with ID {state_id} has no serial {serial}."
+                    )
+            try:
+                return _state_response(types.TerraformState(**data))
+            except pydantic_core.ValidationError as err:
+                raise HTTPException(400, detail=f"Cannot decode the state with ID {state_id}")
+    except admission.Error as err:
+        raise _overloaded(err)
+
+
+@router.get("/outputs")
+async def get_states_outputs(
+    state_id: typing.Annotated[list[str], Query(max_length=100)], request: Request
+) -> dict[str, dict[str, dict] | None]:
+    """
+    Fetch the outputs of many states by their IDs at once.
+
+    The states which are not found are mapped to `null`.
+    """
+    for i in state_id:
+        _authorize(request, i)
+
+    async def fetch(state_id: str) -> dict[str, dict] | None:
+        try:
+            data = await run_in_threadpool(outputs.get, state_id)
+        except storage.NotFound:
+            return None
+        return typing.cast(dict[str, dict], orjson.loads(data)["outputs"])
+
+    try:
+        with _storage_errors():
+            results = await asyncio.gather(*(fetch(i) for i in state_id))
+    except ValueError as err:
+        raise HTTPException(400, detail="Cannot decode the states.")
+    return dict(zip(state_id, results, strict=True))
+
+
+@router.get(
+    "/outputs/{state_id:path}",
+    name="path-convertor",
+    response_model=types.TerraformState,
+    response_class=Response,
+)
+async def get_state_outputs(state_id: str, request: Request) -> Response:
+    """
+    Fetch the outputs of the state by its ID.
+
+    The response is a valid state with the outputs only and without the resources,
+    so it can be used as the `terraform_remote_state` data source address.
+    """
+    _authorize(request, state_id)
+    try:
+        with _storage_errors(state_id):
+            data = await run_in_threadpool(outputs.get, state_id)
+    except ValueError as err:
+        raise HTTPException(400, detail=f"Cannot decode the state with ID {state_id}")
+    return Response(content=data, media_type="application/json")
+
+
+@router.get("/resources/{state_id:path}", name="path-convertor")
+async def get_state_resources(  # noqa: PLR0913
+    state_id: str,
+    request: Request,
+    *,
+    address: str | None = None,
+    module: str | None = None,
+    mode: str | None = None,
+    type: str | None = None,  # noqa: A002
+    name: str | None = None,
+) -> list[dict]:
+    """
+    Fetch the resources of the state by its ID matching all the given filters.
+
+    The resources are found by the state resources index and fetched by the
+    ranged reads of the state, without downloading and decoding the whole state.
+    The `address` is the resource address without the instance key,
+    e.g. `module.vpc.aws_subnet.private`.
+    """
+    _authorize(request, state_id)
+    try:
+        with _storage_errors(state_id):
+            return await run_in_threadpool(
+                functools.partial(
+                    index.query,
+                    state_id,
+                    address=address,
+                    module=module,
+                    mode=mode,
+                    type=type,
+                    name=name,
+                )
+            )
+    except ValueError as err:
+        raise HTTPException(400, detail=f"Cannot decode the state with ID {state_id}")
+
+
+@router.get(
+    "/state/{state_id:path}",
+    name="path-convertor",
+    response_model=types.TerraformState,
+    response_class=Response,
+)
+async def get_state(state_id: str, request: Request) -> Response:
+    """
+    Fetch the state by its ID.
+
+    The state payload is admitted by the admission control, the endpoint
+    will return a 503: Service Unavailable when the server is overloaded.
+    The response is serialized while the payload is still admitted.
+    """
+    _authorize(request, state_id)
+    LOG.info("Fetching state...", state_id=state_id)
+
+    try:
+        async with admission.default.admit(_client(request), await _state_size(state_id)) as ticket:
+            return await _get_state(state_id, ticket)
+    except admission.Error as err:
+        raise _overloaded(err)
+
+
+@router.post("/state/{state_id:path}", name="path-convertor")
+async def post_state(state_id: str, request: Request) -> None:
+    """
+    Create the state by its ID.
+
+    The state payload is admitted by the admission control, the endpoint
+    will return a 503: Service Unavailable when the server is overloaded,
+    and a 413: Content Too Large for the states over the maximum size.
+    The payload stays admitted until its projections are done in background.
+    """
+    _authorize(request, state_id)
+    length = int(request.headers.get("content-length") or 0)
+    if length > config.max_state_size:
+        raise HTTPException(413, detail=f"The state exceeds {config.max_state_size} bytes.")
+    try:
+        async with admission.default.admit(_client(request), length) as ticket:
+            body = await _read_body(request)
+            if not length:
+                await ticket.grow(len(body))
+            await _create_state(state_id, body, ticket)
+    except admission.Error as err:
+        raise _overloaded(err)
+
+
+@router.delete("/state/{state_id:path}", name="path-convertor")
+async def delete_state(state_id: str, request: Request) -> None:
+    """
+    Delete the state by its ID.
+
+    The projections of a recent write are awaited before the state projections
+    are deleted, so they are not left behind or re-added to the catalog.
+    """
+    _authorize(request, state_id)
+    LOG.info("Deleting state...", state_id=state_id)
+
+    with _storage_errors(state_id):
+        await run_in_threadpool(storage.default.delete, state_id)
+    if (projection := _projections.get(state_id)) is not None:
+        await asyncio.wait([projection])
+
+    try:
+        await run_in_threadpool(outputs.delete, state_id)
+        await run_in_threadpool(index.delete, state_id)
     except storage.Error as err:
-        LOG.debug("The storage backend error. %s", str(err))
-        raise HTTPException(
-            502, detail=f"Failed to access the {storage.default.name} storage backend."
-        )
+        LOG.warning("Cannot delete the state projections. %s", str(err), state_id=state_id)
+    if config.history_enabled:
+        try:
+            await run_in_threadpool(history.purge, state_id)
+        except storage.Error as err:
+            LOG.warning("Cannot purge the state history. %s", str(err), state_id=state_id)
+    await run_in_threadpool(_update_catalog, catalog.default.remove, state_id)
+
+
+async def _get_state(state_id: str, ticket: admission.Ticket) -> Response:
+    """Fetch, decode and serialize the state, admitting its actual size once it is known."""
+    with _storage_errors(state_id):
+        body = await run_in_threadpool(storage.default.get, state_id)
+    await ticket.resize(len(body))
 
     try:
         state = types.TerraformState(**orjson.loads(body))
@@ -95,40 +439,104 @@ async def get_state(state_id: str) -> types.TerraformState:
         raise HTTPException(400, detail=f"Cannot decode the state wiith ID {state_id}")
     else:
         LOG.info("Fetched state.", state_id=state_id, lineage=state.lineage, version=state.version)
-        return state
+        return _state_response(state)
 
 
-@router.post("/{state_id:path}", name="path-convertor")
-async def post_state(state_id: str, request: Request) -> None:
-    """Create the state by its ID."""
-    body = await request.body()
+def _state_response(state: types.TerraformState) -> Response:
+    """Serialize the state response, while its payload is still admitted."""
+    return Response(
+        content=orjson.dumps(state.model_dump(mode="json")), media_type="application/json"
+    )
+
+
+async def _create_state(state_id: str, body: bytes, ticket: admission.Ticket) -> None:
+    """Store the admitted state body and schedule its projections on the ticket."""
     sha256 = await service.sha256_digest(body)
     size_mb = round(len(body) / (1024 * 1024), 3)
 
     LOG.info("Creating state...", state_id=state_id, sha256=sha256, size_mb=size_mb)
     try:
-        storage.default.create(state_id, body)
+        state = await service.json_decode(body)
+    except ValueError as err:
+        LOG.warning("Cannot decode the state. %s", str(err), state_id=state_id)
+        state = None
+    with _storage_errors():
+        # The index of the previous state must not be used for the new one.
+        await run_in_threadpool(index.delete, state_id)
+        await run_in_threadpool(storage.default.create, state_id, body)
+    LOG.info("Created state.", state_id=state_id, sha256=sha256, size_mb=size_mb)
+
+    if isinstance(state, dict):
+        try:
+            await run_in_threadpool(outputs.save, state_id, state)
+        except storage.Error as err:
+            LOG.warning("Cannot save the state outputs. %s", str(err), state_id=state_id)
+    ticket.spawn(_project_state(state_id, body, state, sha256))
+
+
+async def _project_state(state_id: str, body: bytes, state: object, sha256: str) -> None:
+    """Update the state projections in background, the write has already succeeded.
+
+    The projections of the successive writes of a state are updated in order.
+    """
+    task = asyncio.current_task()
+    previous = _projections.get(state_id)
+    _projections[state_id] = typing.cast(asyncio.Task[None], task)
+    try:
+        if previous is not None:
+            await asyncio.wait([previous])
+        await run_in_threadpool(_update_catalog, catalog.default.put, state_id, body, state, sha256)
+        if isinstance(state, dict):
+            await run_in_threadpool(_save_index, state_id, body, sha256)
+            if config.history_enabled:
+                await run_in_threadpool(_record_history, state_id, body, state, sha256)
+    finally:
+        if _projections.get(state_id) is task:
+            del _projections[state_id]
+
+
+async def _state_size(state_id: str) -> int:
+    """Estimate the state payload size by the catalog, the maximum state size if unknown."""
+    try:
+        size = await run_in_threadpool(catalog.default.size, state_id)
     except storage.Error as err:
-        LOG.debug("The storage backend error. %s", str(err))
-        raise HTTPException(
-            502, detail=f"Failed to access the {storage.default.name} storage backend."
-        )
-    else:
-        LOG.info("Created state.", state_id=state_id, sha256=sha256, size_mb=size_mb)
+        LOG.warning("Cannot look up the state size. %s", str(err), state_id=state_id)
+        size = None
+    return config.max_state_size if size is None else size
 
 
-@router.delete("/{state_id:path}", name="path-convertor")
-async def delete_state(state_id: str) -> None:
-    """Delete the state by its ID."""
-    LOG.info("Deleting state...", state_id=state_id)
+async def _read_body(request: Request) -> bytes:
+    """Read the request body, up to the maximum state size."""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > config.max_state_size:
+            raise HTTPException(413, detail=f"The state exceeds {config.max_state_size} bytes.")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
 
+def _record_history(state_id: str, body: bytes, state: dict, sha256: str) -> None:
+    """Record the state version in background, the write has already succeeded."""
     try:
-        storage.default.delete(state_id)
-    except storage.NotFound as err:
-        LOG.debug("The storage backend not found error. %s", str(err))
-        raise HTTPException(404, detail=f"The state with ID {state_id} not found.")
+        history.record(state_id, body, state, sha256)
     except storage.Error as err:
-        LOG.debug("The storage backend error. %s", str(err))
-        raise HTTPException(
-            502, detail=f"Failed to access the {storage.default.name} storage backend."
-        )
+        LOG.warning("Cannot record the state version. %s", str(err), state_id=state_id)
+
+
+def _save_index(state_id: str, body: bytes, sha256: str) -> None:
+    """Build and store the state resources index in background."""
+    try:
+        index.save(state_id, index.build(body, sha256))
+    except ValueError as err:
+        LOG.warning("Cannot index the state resources. %s", str(err), state_id=state_id)
+    except storage.Error as err:
+        LOG.warning("Cannot save the state resources index. %s", str(err), state_id=state_id)
+
+
+def _update_catalog(update: typing.Callable[..., None], state_id: str, *args: object) -> None:
+    """Update the states catalog entry, the change has already succeeded."""
+    try:
+        update(state_id, *args)
+    except storage.Error as err:
+        LOG.warning("Cannot update the states catalog. %s", str(err), state_id=state_id)
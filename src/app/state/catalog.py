@@ -0,0 +1,349 @@
+"""
+The states catalog.
+
+The catalog holds the metadata of every state: its size, digest, serial,
+lineage, last write time and lock holder. It is updated on every state write,
+delete, lock and unlock, so the states can be listed without scanning the
+bucket and reading every state. The entries are persisted in the `.catalog/`
+shards by the state ID digest, so an update rereads and rewrites a single small
+shard, and they are served from memory, ordered by the state ID for the prefix
+listing. The served catalog is loaded and reloaded periodically in background
+to see the updates of the other workers, the state requests never wait for it.
+The catalog is rebuilt from the storage by a single bulk pass on demand, or in
+background when it is missing.
+"""
+
+import bisect
+import collections
+import functools
+import hashlib
+import itertools
+import threading
+import time
+import typing
+from concurrent import futures
+from datetime import UTC
+from datetime import datetime
+
+import lazy_object_proxy
+import orjson
+
+from src import errors
+from src import log
+from src import storage
+from src.config import config
+
+from . import types
+
+__all__ = ["Catalog", "Rebuilding", "default"]
+
+LOG = log.get_logger(__name__)
+
+PREFIX = ".catalog/"
+"""The storage keys prefix of the catalog shards."""
+
+DERIVED_SUFFIXES = (".lock", ".outputs", ".index")
+"""The suffixes of the objects stored next to the states."""
+
+Entry = dict[str, typing.Any]
+
+
+class Rebuilding(errors.Error):
+    """Raised when the catalog is listed while the missing catalog is rebuilt."""
+
+
+def _shard(state_id: str) -> str:
+    """The catalog shard of the state."""
+    return hashlib.sha256(state_id.encode()).hexdigest()[:2]
+
+
+def is_state(key: str) -> bool:
+    """Check whether the storage `key` is a state object.
+
+    The keys of the derived objects are not valid state IDs, the API rejects them.
+    """
+    return not (
+        key.startswith((".chunks/", PREFIX))
+        or key.endswith(DERIVED_SUFFIXES)
+        or ".versions/" in key
+    )
+
+
+class Catalog:
+    """The states catalog backed by the default storage backend."""
+
+    def __init__(self) -> None:
+        self._shards: collections.defaultdict[str, dict[str, Entry]] = collections.defaultdict(dict)
+        self._ids: list[str] = []
+        self._lock = threading.Lock()
+        self._loading: futures.Future[None] | None = None
+        self._rebuilding: futures.Future[None] | None = None
+        self._write_locks: collections.defaultdict[str, threading.Lock] = collections.defaultdict(
+            threading.Lock
+        )
+        self._loaded_at: float | None = None
+        # The last write time of the shards, not to replace them with an older reload.
+        self._written: dict[str, float] = {}
+
+    def list_states(
+        self,
+        prefix: str = "",
+        after: str | None = None,
+        limit: int = 100,
+        allowed: typing.Callable[[str], bool] | None = None,
+    ) -> tuple[list[types.StateEntry], str | None]:
+        """List the states with IDs starting with `prefix`, ordered by ID.
+
+        :param after: The state ID to list the states after.
+        :param allowed: Selects the state IDs to list, all of them by default.
+        :return: The states and the cursor of the next page, if there is one.
+        :raises :class:`Rebuilding`
+        """
+        self._load()
+        with self._lock:
+            if after is not None and after >= prefix:
+                start = bisect.bisect_right(self._ids, after)
+            else:
+                start = bisect.bisect_left(self._ids, prefix)
+            ids: list[str] = []
+            for state_id in itertools.islice(self._ids, start, None):
+                if not state_id.startswith(prefix) or len(ids) > limit:
+                    break
+                if allowed is None or allowed(state_id):
+                    ids.append(state_id)
+            entries = [types.StateEntry(**self._shards[_shard(i)][i]) for i in ids[:limit]]
+        return entries, (ids[limit - 1] if len(ids) > limit else None)
+
+    def get(self, state_id: str, *, wait: bool = True) -> types.StateEntry | None:
+        """Get the catalog entry of the state, if any.
+
+        :param wait: Wait for the first load of the catalog, otherwise the entry
+            is unknown (`None`) until the catalog is loaded or rebuilt.
+        :raises :class:`Rebuilding` with `wait`.
+        """
+        self._load(wait)
+        with self._lock:
+            entry = self._shards[_shard(state_id)].get(state_id)
+        return types.StateEntry(**entry) if entry else None
+
+    def size(self, state_id: str) -> int | None:
+        """Get the cataloged state size, `None` until the catalog is loaded."""
+        self._load(wait=False)
+        with self._lock:
+            entry = self._shards[_shard(state_id)].get(state_id)
+        return entry.get("size") if entry else None
+
+    def put(self, state_id: str, body: bytes, state: typing.Any, sha256: str) -> None:  # noqa: ANN401
+        """Update the state entry on the state write.
+
+        :param state: The decoded state body.
+        """
+        fields = _describe(body, state, sha256)
+        fields["updated_at"] = datetime.now(UTC).isoformat()
+        self._update(state_id, lambda entry: entry | fields)
+
+    def lock(self, state_id: str, lock_info: dict[str, typing.Any]) -> None:
+        """Update the state entry on the state lock."""
+        fields = {"lock_id": lock_info.get("id"), "locked_by": lock_info.get("who")}
+        self._update(state_id, lambda entry: entry | fields)
+
+    def unlock(self, state_id: str) -> None:
+        """Update the state entry on the state unlock."""
+
+        def change(entry: Entry) -> Entry | None:
+            if entry.get("size") is None:
+                # The state was locked, but never written.
+                return None
+            return entry | {"lock_id": None, "locked_by": None}
+
+        self._update(state_id, change)
+
+    def remove(self, state_id: str) -> None:
+        """Remove the state entry on the state delete."""
+        self._update(state_id, lambda _: None)
+
+    def rebuild(self) -> int:
+        """Rebuild the catalog by reading all the states from the storage.
+
+        :return: The number of the cataloged states.
+        """
+        objects = storage.default.list_objects()
+        states = [obj for obj in objects if is_state(obj.key)]
+        locks = [obj.key for obj in objects if obj.key.endswith(".lock")]
+        LOG.info("Rebuilding the states catalog...", states=len(states), locks=len(locks))
+
+        entries = {e["id"]: e for e in _executor().map(_read_state, states) if e is not None}
+        for key, lock_info in zip(locks, _executor().map(_read_lock, locks), strict=True):
+            if lock_info:
+                state_id = key.removesuffix(".lock")
+                entry = entries.setdefault(state_id, {"id": state_id})
+                entry.update(lock_id=lock_info.get("id"), locked_by=lock_info.get("who"))
+
+        shards: collections.defaultdict[str, dict[str, Entry]] = collections.defaultdict(dict)
+        for state_id, entry in entries.items():
+            shards[_shard(state_id)][state_id] = entry
+        stale = {obj.key for obj in objects if obj.key.startswith(PREFIX)}
+        stale -= {PREFIX + shard for shard in shards}
+        list(
+            _executor().map(
+                lambda shard: storage.default.create(PREFIX + shard, orjson.dumps(shards[shard])),
+                shards,
+            )
+        )
+        list(_executor().map(storage.default.delete, stale))
+
+        with self._lock:
+            self._shards = shards
+            self._ids = sorted(entries)
+            self._loaded_at = time.monotonic()
+        LOG.info("Rebuilt the states catalog.", states=len(entries))
+        return len(entries)
+
+    def _load(self, wait: bool = True) -> None:
+        """Load the catalog in background, unless it is loaded or being loaded.
+
+        The loaded catalog is reloaded after `catalog_refresh_interval` seconds,
+        meanwhile the callers are served by the loaded one.
+
+        :param wait: Wait for the first load of the catalog, and raise
+            :class:`Rebuilding` while the missing catalog is rebuilt.
+        """
+        with self._lock:
+            loading = self._loading
+            if (
+                (loading is None or loading.done())
+                and (self._rebuilding is None or self._rebuilding.done())
+                and (
+                    self._loaded_at is None
+                    or time.monotonic() - self._loaded_at >= config.catalog_refresh_interval
+                )
+            ):
+                loading = self._loading = _loader().submit(self._reload)
+            loaded = self._loaded_at is not None
+        if not wait:
+            return
+        if not loaded and loading is not None:
+            loading.result()
+        if self._rebuilding is not None and not self._rebuilding.done():
+            raise Rebuilding("The states catalog is being rebuilt.")
+
+    def _reload(self) -> None:
+        """Load the catalog shards, rebuild the catalog in background when there are none."""
+        started = time.monotonic()
+        try:
+            keys = [obj.key for obj in storage.default.list_objects(PREFIX)]
+            blobs = list(_executor().map(storage.default.get, keys))
+        except storage.Error as err:
+            LOG.warning("Cannot load the states catalog. %s", str(err))
+            raise
+
+        shards: collections.defaultdict[str, dict[str, Entry]] = collections.defaultdict(dict)
+        for key, data in zip(keys, blobs, strict=True):
+            shards[key.removeprefix(PREFIX)] = orjson.loads(data)
+        with self._lock:
+            written = {
+                shard
+                for shard, at in self._written.items()
+                if self._loaded_at is None or at > started
+            }
+            for shard in written:
+                shards[shard] = self._shards[shard]
+            self._shards = shards
+            self._ids = sorted(i for entries in shards.values() for i in entries)
+            self._loaded_at = started
+            # The shards written by this worker before its first load do not make it present.
+            if not {key.removeprefix(PREFIX) for key in keys} - written:
+                LOG.info("The states catalog is missing, rebuilding it in background.")
+                self._rebuilding = _loader().submit(self._rebuild_missing)
+
+    def _rebuild_missing(self) -> None:
+        """Rebuild the missing catalog, it is rebuilt again on the next reload on failure."""
+        try:
+            self.rebuild()
+        except storage.Error as err:
+            LOG.warning("Cannot rebuild the missing states catalog. %s", str(err))
+
+    def _update(self, state_id: str, change: typing.Callable[[Entry], Entry | None]) -> None:
+        """Apply the `change` to the state entry and persist its shard.
+
+        The shard is reread before the change to keep the updates of the other
+        workers. The shard writes of a worker are ordered, while the workers
+        may still race between the read and the write of the same shard,
+        and the lost entry is then restored by the rebuild.
+
+        :param change: Returns the updated entry, or `None` to remove the entry.
+        """
+        self._load(wait=False)
+        shard = _shard(state_id)
+        with self._write_locks[shard]:
+            try:
+                entries: dict[str, Entry] = orjson.loads(storage.default.get(PREFIX + shard))
+            except storage.NotFound:
+                entries = {}
+            entry = change(entries.get(state_id) or {"id": state_id})
+            if entry is None:
+                entries.pop(state_id, None)
+            else:
+                entries[state_id] = entry
+            with self._lock:
+                self._written[shard] = time.monotonic()
+            storage.default.create(PREFIX + shard, orjson.dumps(entries))
+
+            with self._lock:
+                loaded = self._shards[shard]
+                for removed in loaded.keys() - entries.keys():
+                    del self._ids[bisect.bisect_left(self._ids, removed)]
+                for added in entries.keys() - loaded.keys():
+                    bisect.insort(self._ids, added)
+                self._shards[shard] = entries
+                self._written[shard] = time.monotonic()
+
+
+def _describe(body: bytes, state: typing.Any, sha256: str) -> Entry:  # noqa: ANN401
+    """Build the entry fields describing the state body."""
+    fields: Entry = {"size": len(body), "sha256": sha256, "serial": None, "lineage": None}
+    if isinstance(state, dict):
+        serial, lineage = state.get("serial"), state.get("lineage")
+        fields["serial"] = serial if isinstance(serial, int) else None
+        fields["lineage"] = lineage if isinstance(lineage, str) else None
+    return fields
+
+
+def _read_state(obj: storage.ObjectInfo) -> Entry | None:
+    """Read the state object to build its entry, `None` when it is gone."""
+    try:
+        body = storage.default.get(obj.key)
+    except storage.NotFound:
+        return None
+    try:
+        state = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        state = None
+    entry = {"id": obj.key, **_describe(body, state, hashlib.sha256(body).hexdigest())}
+    entry["updated_at"] = obj.modified.isoformat() if obj.modified else None
+    return entry
+
+
+def _read_lock(key: str) -> dict[str, typing.Any] | None:
+    """Read the lock info of the lock object, if it is still there."""
+    try:
+        lock_info = orjson.loads(storage.default.get(key))
+    except (storage.NotFound, orjson.JSONDecodeError):
+        return None
+    return lock_info if isinstance(lock_info, dict) else None
+
+
+@functools.cache
+def _executor() -> futures.ThreadPoolExecutor:
+    """The thread pool reading the catalog and the states concurrently."""
+    return futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="catalog")
+
+
+@functools.cache
+def _loader() -> futures.ThreadPoolExecutor:
+    """The thread loading and rebuilding the catalogs in background."""
+    return futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-loader")
+
+
+default: Catalog = lazy_object_proxy.Proxy(Catalog)
+"""Default states catalog instance (lazy object)."""
@@ -0,0 +1,159 @@
+"""
+The compact JSON deltas between two decoded JSON documents.
+
+A delta is a JSON document itself, one of:
+
+- `{"=": value}` replaces the value;
+- `{"+": {key: value}, "-": [key], "~": {key: delta}}` sets, deletes and patches
+  the object keys;
+- `{"*": [[index, delta]], "/": [[start, end, [items]]]}` patches and splices
+  the array elements, where the indexes refer to the old array.
+
+Arrays are matched element-wise by their canonical JSON encoding, and the changed
+elements are aligned by their address fields (see :data:`IDENTITY`), so a changed
+resource in the middle of the `resources` list produces a delta of the changed
+attributes only, instead of a copy of the whole list.
+"""
+
+import difflib
+import typing
+
+import orjson
+
+__all__ = ["Delta", "diff", "patch"]
+
+Delta = dict[str, typing.Any]
+
+IDENTITY = ("module", "mode", "type", "name", "index_key")
+"""The fields identifying the state resources and instances."""
+
+
+def diff(old: typing.Any, new: typing.Any) -> Delta | None:  # noqa: ANN401
+    """Compute the delta turning `old` into `new`, `None` when they are equal."""
+    if _equal(old, new):
+        return None
+    if isinstance(old, dict) and isinstance(new, dict):
+        return _diff_dict(old, new)
+    if isinstance(old, list) and isinstance(new, list):
+        return _diff_list(old, new)
+    return {"=": new}
+
+
+def patch(old: typing.Any, delta: Delta | None) -> typing.Any:  # noqa: ANN401
+    """Apply the `delta` to `old` and return the new value. The `old` is not modified."""
+    if delta is None:
+        return old
+    if "=" in delta:
+        return delta["="]
+    if "*" in delta or "/" in delta:
+        items = list(old)
+        for index, sub in delta.get("*", ()):
+            items[index] = patch(old[index], sub)
+        for start, end, values in reversed(delta.get("/", ())):
+            items[start:end] = values
+        return items
+    new = dict(old)
+    for key in delta.get("-", ()):
+        new.pop(key, None)
+    new.update(delta.get("+", {}))
+    for key, sub in delta.get("~", {}).items():
+        new[key] = patch(old[key], sub)
+    return new
+
+
+def _diff_dict(old: dict, new: dict) -> Delta:
+    set_: dict[str, typing.Any] = {}
+    sub: dict[str, Delta] = {}
+    for key, value in new.items():
+        if key not in old:
+            set_[key] = value
+        elif (d := diff(old[key], value)) is not None:
+            if "=" in d:
+                set_[key] = value
+            else:
+                sub[key] = d
+    delta: Delta = {}
+    if set_:
+        delta["+"] = set_
+    if deleted := [key for key in old if key not in new]:
+        delta["-"] = deleted
+    if sub:
+        delta["~"] = sub
+    return delta
+
+
+def _diff_list(old: list, new: list) -> Delta:
+    sub: list[list] = []
+    splice: list[list] = []
+    new_keys = _keys(new)
+    matcher = difflib.SequenceMatcher(None, _keys(old), new_keys, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        old_ids = [_identity(item) for item in old[i1:i2]]
+        new_ids = [_identity(item) for item in new[j1:j2]]
+        spans = [(i1, i2, j1, j2)]
+        if tag == "replace" and None not in old_ids and None not in new_ids:
+            # Align the changed elements by their identity, so the updated resources
+            # are still patched in place when some others are added or removed.
+            aligner = difflib.SequenceMatcher(None, old_ids, new_ids, autojunk=False)
+            spans = [
+                (i1 + a1, i1 + a2, j1 + b1, j1 + b2) for _, a1, a2, b1, b2 in aligner.get_opcodes()
+            ]
+        for span in spans:
+            span_sub, span_splice = _replace(old, new, new_keys, span)
+            sub.extend(span_sub)
+            splice.extend(span_splice)
+
+    delta: Delta = {}
+    if sub:
+        delta["*"] = sub
+    if splice:
+        delta["/"] = splice
+    return delta
+
+
+def _replace(
+    old: list, new: list, new_keys: list[bytes], span: tuple[int, int, int, int]
+) -> tuple[list[list], list[list]]:
+    """Build the operations replacing `old[i1:i2]` with `new[j1:j2]`."""
+    i1, i2, j1, j2 = span
+    if i2 - i1 != j2 - j1:
+        return [], [[i1, i2, new[j1:j2]]]
+
+    sub: list[list] = []
+    splice: list[list] = []
+    # Elements replaced one-to-one are most likely updated in place,
+    # keep the element delta unless the new element itself is smaller.
+    for i, j in zip(range(i1, i2), range(j1, j2), strict=True):
+        if _equal(old[i], new[j]):
+            continue
+        d = diff(old[i], new[j]) if isinstance(old[i], dict | list) else None
+        if d is not None and len(orjson.dumps(d)) < len(new_keys[j]):
+            sub.append([i, d])
+        else:
+            splice.append([i, i + 1, [new[j]]])
+    return sub, splice
+
+
+def _equal(old: typing.Any, new: typing.Any) -> bool:  # noqa: ANN401
+    """Check the values are equal as JSON, unlike `==` telling `1`, `1.0` and `true` apart."""
+    if old != new or type(old) is not type(new):
+        return False
+    if isinstance(old, dict):
+        return all(_equal(value, new[key]) for key, value in old.items())
+    if isinstance(old, list):
+        return all(map(_equal, old, new))
+    return True
+
+
+def _identity(item: typing.Any) -> bytes | None:  # noqa: ANN401
+    """The encoding of the element address fields, if it has any."""
+    if isinstance(item, dict) and (fields := {k: item[k] for k in IDENTITY if k in item}):
+        return orjson.dumps(fields, option=orjson.OPT_SORT_KEYS)
+    return None
+
+
+def _keys(items: list) -> list[bytes]:
+    """The canonical encoding of the list elements used for matching."""
+    return [orjson.dumps(item, option=orjson.OPT_SORT_KEYS) for item in items]
@@ -0,0 +1,203 @@
+"""
+The state version history.
+
+Every state write is recorded as a new version next to the state object:
+a periodic full snapshot, and compact JSON deltas (see :mod:`.delta`) between
+successive serials otherwise. The versions are listed in the history index
+object, and any serial is reconstructed by applying the deltas to the nearest
+preceding snapshot. The compaction bounds the number of versions and the
+total stored bytes by dropping the oldest versions.
+
+The delta base is the reconstructed head version, so the state write does not
+fetch the state it replaces. The history updates of a state are serialized
+in-process, as they read, modify and write its history index.
+"""
+
+import threading
+import typing
+from datetime import UTC
+from datetime import datetime
+
+import orjson
+
+from src import log
+from src import storage
+from src.config import config
+
+from . import delta
+from . import types
+
+__all__ = ["record", "list_versions", "get_version", "purge"]
+
+LOG = log.get_logger(__name__)
+
+_locks = [threading.Lock() for _ in range(64)]
+"""The history update locks, striped by the state ID."""
+
+
+class NotFound(storage.NotFound):
+    """Raised when the requested version is not found."""
+
+
+def _key(state_id: str, name: str) -> str:
+    """Build the storage key of a history object."""
+    return f"{state_id}.versions/{name}"
+
+
+def list_versions(state_id: str) -> list[types.StateVersion]:
+    """List the recorded versions of the state, oldest first."""
+    try:
+        data = orjson.loads(storage.default.get(_key(state_id, "index.json")))
+    except storage.NotFound:
+        return []
+    return [types.StateVersion(**v) for v in data["versions"]]
+
+
+def get_version(state_id: str, serial: int) -> dict[str, typing.Any]:
+    """Reconstruct the decoded state of the given `serial`.
+
+    :raises :class:`NotFound`
+    """
+    versions = list_versions(state_id)
+    for i, version in enumerate(versions):
+        if version.serial == serial:
+            return _reconstruct(state_id, versions[: i + 1])
+    raise NotFound(f"The {state_id} state has no version with serial {serial}.")
+
+
+def record(state_id: str, body: bytes, state: dict[str, typing.Any], sha256: str) -> None:
+    """Record the new version of the state and compact the history.
+
+    :param body: The new state body.
+    :param state: The decoded new state body.
+    :param sha256: The SHA-256 hex digest of the new state body.
+    """
+    try:
+        serial, lineage = int(state["serial"]), str(state["lineage"])
+    except (ValueError, TypeError, KeyError) as err:
+        LOG.warning("Cannot record the state version. %s", str(err), state_id=state_id)
+        return
+
+    with _lock(state_id):
+        versions = list_versions(state_id)
+        dropped = [v for v in versions if v.serial >= serial]
+        versions = [v for v in versions if v.serial < serial]
+
+        kind: typing.Literal["full", "delta"] = "full"
+        data = body
+        if (
+            versions
+            and versions[-1].lineage == lineage
+            and _chain_length(versions) < config.history_snapshot_interval
+        ):
+            patch = orjson.dumps(delta.diff(_reconstruct(state_id, versions), state))
+            # Fall back to the snapshot when the state is mostly rewritten.
+            if len(patch) < len(body) // 2:
+                kind, data = "delta", patch
+
+        version = types.StateVersion(
+            serial=serial,
+            lineage=lineage,
+            kind=kind,
+            size=len(data),
+            sha256=sha256,
+            created=datetime.now(UTC),
+        )
+        storage.default.create(_key(state_id, version.object_name), data)
+        versions.append(version)
+        versions, compacted = _compact(state_id, versions)
+        _save_index(state_id, versions)
+        kept = {v.object_name for v in versions}
+        _delete(state_id, [v for v in dropped + compacted if v.object_name not in kept])
+
+        LOG.info(
+            "Recorded state version.",
+            state_id=state_id,
+            serial=serial,
+            kind=kind,
+            size=len(data),
+            versions=len(versions),
+        )
+
+
+def purge(state_id: str) -> None:
+    """Delete the whole history of the state."""
+    with _lock(state_id):
+        versions = list_versions(state_id)
+        _delete(state_id, versions)
+        try:
+            storage.default.delete(_key(state_id, "index.json"))
+        except storage.NotFound:
+            pass
+
+
+def _lock(state_id: str) -> threading.Lock:
+    return _locks[hash(state_id) % len(_locks)]
+
+
+def _chain_length(versions: list[types.StateVersion]) -> int:
+    """The number of deltas after the last snapshot."""
+    length = 0
+    for version in reversed(versions):
+        if version.kind == "full":
+            break
+        length += 1
+    return length
+
+
+def _reconstruct(state_id: str, versions: list[types.StateVersion]) -> dict[str, typing.Any]:
+    """Reconstruct the state of the last of `versions` from its chain."""
+    start = len(versions) - 1 - _chain_length(versions)
+    if start < 0:
+        raise storage.Error(f"The {state_id} state history has no base snapshot.")
+    state = orjson.loads(storage.default.get(_key(state_id, versions[start].object_name)))
+    for version in versions[start + 1 :]:
+        patch = orjson.loads(storage.default.get(_key(state_id, version.object_name)))
+        state = delta.patch(state, patch)
+    return typing.cast(dict[str, typing.Any], state)
+
+
+def _compact(
+    state_id: str, versions: list[types.StateVersion]
+) -> tuple[list[types.StateVersion], list[types.StateVersion]]:
+    """Drop the oldest versions exceeding the history limits.
+
+    When the oldest kept version is a delta, it is rebased into a snapshot.
+
+    :return: The kept and the dropped versions.
+    """
+    keep = len(versions)
+    total = 0
+    for i in range(len(versions) - 1, -1, -1):
+        total += versions[i].size
+        if len(versions) - i > config.history_max_versions or (
+            total > config.history_max_bytes and i < len(versions) - 1
+        ):
+            break
+        keep = i
+    if keep == 0:
+        return versions, []
+
+    dropped, kept = versions[:keep], versions[keep:]
+    if kept[0].kind == "delta":
+        state = _reconstruct(state_id, versions[: keep + 1])
+        data = orjson.dumps(state)
+        kept[0] = kept[0].model_copy(update={"kind": "full", "size": len(data)})
+        storage.default.create(_key(state_id, kept[0].object_name), data)
+        dropped.append(versions[keep])
+
+    LOG.info("Compacted state history.", state_id=state_id, dropped=keep)
+    return kept, dropped
+
+
+def _save_index(state_id: str, versions: list[types.StateVersion]) -> None:
+    data = {"versions": [v.model_dump(mode="json") for v in versions]}
+    storage.default.create(_key(state_id, "index.json"), orjson.dumps(data))
+
+
+def _delete(state_id: str, versions: list[types.StateVersion]) -> None:
+    for version in versions:
+        try:
+            storage.default.delete(_key(state_id, version.object_name))
+        except storage.NotFound:
+            pass
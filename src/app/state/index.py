@@ -0,0 +1,223 @@
+"""
+The per-state resources index.
+
+The index maps every resource of the state to its address fields and to the
+byte range of its JSON object in the state body. The resources matching a query
+are then fetched by ranged reads of the state object, instead of downloading
+and decoding the whole state. The index is built on every state write, stored
+next to the state object, and rebuilt when it is missing or outdated. The index
+is deleted before the state write, and it is outdated when its digest differs
+from the digest of the state in the states catalog.
+"""
+
+import hashlib
+import json
+import re
+import typing
+
+import orjson
+
+from src import log
+from src import storage
+
+from . import catalog
+
+__all__ = ["build", "save", "query", "delete", "address"]
+
+LOG = log.get_logger(__name__)
+
+FIELDS = ("module", "mode", "type", "name")
+"""The resource fields the index can be queried by."""
+
+COALESCE_GAP = 64 * 1024
+"""The maximum gap in bytes between two ranges fetched with a single read."""
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+class OutdatedIndex(storage.Error):
+    """Raised when the index does not match the state body."""
+
+
+def _key(state_id: str) -> str:
+    """Build the storage key of the state resources index."""
+    return f"{state_id}.index"
+
+
+def address(record: dict[str, typing.Any]) -> str:
+    """Build the resource address, e.g. `module.vpc.data.aws_ami.ubuntu`."""
+    parts = [record["module"]] if record.get("module") else []
+    if record.get("mode") == "data":
+        parts.append("data")
+    parts += [record.get("type", ""), record.get("name", "")]
+    return ".".join(parts)
+
+
+def build(body: bytes, sha256: str | None = None) -> dict[str, typing.Any]:
+    """Build the resources index of the state body.
+
+    :param sha256: The SHA-256 hex digest of the body, if it is already known.
+    :raises :class:`ValueError` when the body is not a JSON object.
+    """
+    text = body.decode()
+    try:
+        spans = _scan_resources(text)
+    except IndexError as err:
+        raise ValueError("Unexpected end of the state.") from err
+
+    records = []
+    for start, end, resource in spans:
+        record = {field: resource.get(field, "") for field in FIELDS}
+        record["instances"] = len(resource.get("instances") or ())
+        record["start"], record["end"] = start, end
+        records.append(record)
+
+    if not body.isascii():
+        # Convert the characters offsets into the bytes offsets.
+        char = byte = 0
+        for record in records:
+            for field in ("start", "end"):
+                byte += len(text[char : record[field]].encode())
+                char = record[field]
+                record[field] = byte
+    return {
+        "size": len(body),
+        "sha256": sha256 or hashlib.sha256(body).hexdigest(),
+        "resources": records,
+    }
+
+
+def save(state_id: str, index: dict[str, typing.Any]) -> None:
+    """Store the resources index of the state."""
+    storage.default.create(_key(state_id), orjson.dumps(index))
+
+
+def delete(state_id: str) -> None:
+    """Delete the resources index of the state."""
+    try:
+        storage.default.delete(_key(state_id))
+    except storage.NotFound:
+        pass
+
+
+def query(state_id: str, **filters: str | None) -> list[dict[str, typing.Any]]:
+    """Fetch the state resources matching all the given `filters`.
+
+    The filters are the :data:`FIELDS` and the resource `address`.
+
+    :raises :class:`storage.NotFound`
+    """
+    entry = catalog.default.get(state_id, wait=False)
+    try:
+        index = orjson.loads(storage.default.get(_key(state_id)))
+        if entry is not None and entry.sha256 and entry.sha256 != index.get("sha256"):
+            raise OutdatedIndex("The state digest differs from the cataloged one.")
+        return _fetch(state_id, index["size"], _match(index, filters))
+    except storage.NotFound:
+        LOG.info("Building the missing state resources index.", state_id=state_id)
+    except OutdatedIndex as err:
+        LOG.info("Rebuilding the outdated state resources index. %s", str(err), state_id=state_id)
+
+    body = storage.default.get(state_id)
+    index = build(body)
+    if entry is None or entry.sha256 in {None, index["sha256"]}:
+        # Otherwise, the state is being rewritten and the index is saved by the writer.
+        save(state_id, index)
+    return [orjson.loads(body[r["start"] : r["end"]]) for r in _match(index, filters)]
+
+
+def _match(
+    index: dict[str, typing.Any], filters: dict[str, str | None]
+) -> list[dict[str, typing.Any]]:
+    """Select the index records matching the filters."""
+    filters = {k: v for k, v in filters.items() if v is not None}
+    addr = filters.pop("address", None)
+    return [
+        record
+        for record in index["resources"]
+        if all(record.get(k) == v for k, v in filters.items())
+        and (addr is None or address(record) == addr)
+    ]
+
+
+def _fetch(
+    state_id: str, size: int, records: list[dict[str, typing.Any]]
+) -> list[dict[str, typing.Any]]:
+    """Fetch the resources of the records by the ranged reads of the state.
+
+    :raises :class:`OutdatedIndex` when the fetched resources do not match the records.
+    """
+    groups = _coalesce(records)
+    if sum(end - start for start, end, _ in groups) > size // 2:
+        # Most of the state is requested, a single read is cheaper.
+        groups = [(0, size, records)]
+
+    resources = []
+    for start, end, group in groups:
+        data = storage.default.get_range(state_id, start, end - start)
+        for record in group:
+            try:
+                resource = orjson.loads(data[record["start"] - start : record["end"] - start])
+            except ValueError as err:
+                raise OutdatedIndex(f"Cannot decode the {address(record)} resource.") from err
+            if not isinstance(resource, dict) or any(
+                resource.get(field, "") != record[field] for field in FIELDS
+            ):
+                raise OutdatedIndex(f"The {address(record)} resource has moved.")
+            resources.append(resource)
+    return resources
+
+
+def _coalesce(
+    records: list[dict[str, typing.Any]],
+) -> list[tuple[int, int, list[dict[str, typing.Any]]]]:
+    """Group the records with close byte ranges to fetch them at once."""
+    groups: list[tuple[int, int, list[dict[str, typing.Any]]]] = []
+    for record in sorted(records, key=lambda r: r["start"]):
+        if groups and record["start"] - groups[-1][1] <= COALESCE_GAP:
+            start, _, group = groups[-1]
+            group.append(record)
+            groups[-1] = (start, record["end"], group)
+        else:
+            groups.append((record["start"], record["end"], [record]))
+    return groups
+
+
+def _scan_resources(text: str) -> list[tuple[int, int, dict[str, typing.Any]]]:
+    """Find the character ranges of the `resources` array elements in the state."""
+    pos = _skip(text, 0)
+    _expect(text, pos, "{")
+    pos = _skip(text, pos + 1)
+    spans: list[tuple[int, int, dict[str, typing.Any]]] = []
+    while text[pos] != "}":
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = _skip(text, pos)
+        _expect(text, pos, ":")
+        pos = _skip(text, pos + 1)
+        if key == "resources" and text[pos] == "[":
+            pos = _skip(text, pos + 1)
+            while text[pos] != "]":
+                resource, end = _decoder.raw_decode(text, pos)
+                spans.append((pos, end, resource))
+                pos = _skip(text, end)
+                if text[pos] == ",":
+                    pos = _skip(text, pos + 1)
+            pos += 1
+        else:
+            _, pos = _decoder.raw_decode(text, pos)
+        pos = _skip(text, pos)
+        if text[pos] == ",":
+            pos = _skip(text, pos + 1)
+    return spans
+
+
+def _skip(text: str, pos: int) -> int:
+    """Skip the whitespaces starting at `pos`."""
+    match = _WHITESPACE.match(text, pos)
+    return match.end() if match else pos
+
+
+def _expect(text: str, pos: int, char: str) -> None:
+    if text[pos : pos + 1] != char:
+        raise ValueError(f"Expecting {char!r} at {pos}.")
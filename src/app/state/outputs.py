@@ -0,0 +1,89 @@
+"""
+The outputs-only projection of the states.
+
+The projection is a valid state document with the outputs and without the
+resources, so it can be used as the `terraform_remote_state` address directly.
+It is precomputed on every state write, stored next to the state object, and
+cached in-process. A missing projection is rebuilt from the full state and
+cached only, as it may be older than the one stored by a concurrent write.
+"""
+
+import contextlib
+import typing
+
+import lazy_object_proxy
+import orjson
+
+from src import cache
+from src import log
+from src import storage
+from src.config import config
+
+__all__ = ["project", "save", "get", "delete"]
+
+LOG = log.get_logger(__name__)
+
+_cache: "cache.TTLCache[str, bytes]" = lazy_object_proxy.Proxy(
+    lambda: cache.TTLCache(config.outputs_cache_size, config.outputs_cache_ttl)
+)
+"""The outputs projections cache (lazy object)."""
+
+
+def _key(state_id: str) -> str:
+    """Build the storage key of the state outputs projection."""
+    return f"{state_id}.outputs"
+
+
+def project(state: dict[str, typing.Any]) -> bytes:
+    """Build the outputs-only projection of the decoded state."""
+    return orjson.dumps(
+        {
+            "version": state.get("version"),
+            "terraform_version": state.get("terraform_version"),
+            "serial": state.get("serial"),
+            "lineage": state.get("lineage"),
+            "outputs": state.get("outputs") or {},
+            "resources": [],
+            "check_results": None,
+        }
+    )
+
+
+def save(state_id: str, state: dict[str, typing.Any]) -> None:
+    """Store the outputs projection of the written state."""
+    data = project(state)
+    _cache.pop(state_id)
+    try:
+        storage.default.create(_key(state_id), data)
+    except storage.Error:
+        # Do not leave the projection of the previous serial behind.
+        with contextlib.suppress(storage.Error):
+            delete(state_id)
+        raise
+    _cache.set(state_id, data)
+
+
+def get(state_id: str) -> bytes:
+    """Fetch the outputs projection of the state, rebuilding it when missing.
+
+    :raises :class:`storage.NotFound`
+    """
+    if (data := _cache.get(state_id)) is not None:
+        return data
+    try:
+        data = storage.default.get(_key(state_id))
+    except storage.NotFound:
+        LOG.info("Rebuilding the state outputs.", state_id=state_id)
+        data = project(orjson.loads(storage.default.get(state_id)))
+    # The projection cached by a concurrent write meanwhile is newer.
+    _cache.add(state_id, data)
+    return data
+
+
+def delete(state_id: str) -> None:
+    """Delete the outputs projection of the state."""
+    _cache.pop(state_id)
+    try:
+        storage.default.delete(_key(state_id))
+    except storage.NotFound:
+        pass
@@ -1,8 +1,20 @@
 import asyncio
 import hashlib
+import typing
+
+import orjson
 
 
 async def sha256_digest(data: bytes) -> str:
     """Compute the SHA-256 hash of the given bytes in a separate thread."""
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, lambda: hashlib.sha256(data).hexdigest())
+
+
+async def json_decode(data: bytes) -> typing.Any:  # noqa: ANN401
+    """Decode the JSON document in a separate thread.
+
+    :raises :class:`ValueError`
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, orjson.loads, data)
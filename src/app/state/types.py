@@ -1,9 +1,10 @@
+import typing
 from datetime import datetime
 
 from pydantic import BaseModel
 from pydantic import Field
 
-__all__ = ["TerraformState"]
+__all__ = ["TerraformState", "LockInfo", "StateVersion", "StateEntry", "StateList"]
 
 
 class TerraformState(BaseModel):
@@ -68,3 +69,45 @@ class LockInfo(BaseModel):
                 "Path": "",
             }
         }
+
+
+class StateVersion(BaseModel):
+    """Represents a recorded version of a state in the state history."""
+
+    serial: int = Field(..., description="The state serial of this version.")
+    lineage: str = Field(..., description="The state lineage of this version.")
+    kind: typing.Literal["full", "delta"] = Field(
+        ..., description="Whether the version is stored as a full snapshot or a delta."
+    )
+    size: int = Field(..., description="The stored size of the version in bytes.")
+    sha256: str = Field(..., description="The SHA-256 digest of the full state body.")
+    created: datetime = Field(..., description="Timestamp when the version was recorded.")
+
+    @property
+    def object_name(self) -> str:
+        """The name of the version object in the history."""
+        return f"{self.serial}.json" if self.kind == "full" else f"{self.serial}.delta.json"
+
+
+class StateEntry(BaseModel):
+    """Represents the metadata of a state in the states catalog."""
+
+    id: str = Field(..., description="The state ID.")
+    size: int | None = Field(default=None, description="The size of the state body in bytes.")
+    sha256: str | None = Field(default=None, description="The SHA-256 digest of the state body.")
+    serial: int | None = Field(default=None, description="The state serial.")
+    lineage: str | None = Field(default=None, description="The state lineage.")
+    updated_at: datetime | None = Field(
+        default=None, description="Timestamp when the state was last written."
+    )
+    lock_id: str | None = Field(default=None, description="The ID of the held state lock.")
+    locked_by: str | None = Field(default=None, description="Who holds the state lock.")
+
+
+class StateList(BaseModel):
+    """Represents a page of the states listing."""
+
+    states: list[StateEntry] = Field(..., description="The states, ordered by ID.")
+    next: str | None = Field(
+        default=None, description="The `after` cursor of the next page, if there is one."
+    )
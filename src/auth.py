@@ -0,0 +1,289 @@
+"""
+The HTTP basic authentication and the state authorization.
+
+The users are configured with slow password hashes (scrypt, or argon2 with the
+optional `argon2-cffi` package) and the state ID prefixes they have access to.
+A slow hash takes tens of milliseconds to verify, so the successful verifications
+are cached for a short time, keyed by the HMAC digest of the `Authorization`
+header under a per-process random key. The header is never stored, and the
+lookup time does not depend on how close a guessed header is to a valid one.
+The unknown users are verified against the dummy hashes with the schemes and
+parameters of the configured ones, so they take as long to reject. A verification
+takes tens of megabytes of memory, so only a few of them run at once, and the
+rejected headers are cached as well, so they are not verified again.
+"""
+
+import base64
+import binascii
+import dataclasses
+import hashlib
+import hmac
+import os
+import threading
+
+import lazy_object_proxy
+
+from src import cache
+from src import errors
+from src import log
+from src.config import config
+
+__all__ = [
+    "default",
+    "Authenticator",
+    "User",
+    "Error",
+    "Unauthorized",
+    "Forbidden",
+    "Busy",
+    "hash_password",
+    "verify_password",
+    "check_hash",
+]
+
+LOG = log.get_logger(__name__)
+
+SCRYPT_N = 2**15
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+class Error(errors.Error):
+    """The authentication error."""
+
+
+class Unauthorized(Error):
+    """Raised when the request has no basic authentication credentials."""
+
+
+class Forbidden(Error):
+    """Raised when the username or password is incorrect."""
+
+
+class Busy(Error):
+    """Raised when too many password hashes are verified at once."""
+
+
+@dataclasses.dataclass(frozen=True)
+class User:
+    """The authenticated user."""
+
+    name: str
+    prefixes: tuple[str, ...]
+
+    def can_access(self, state_id: str) -> bool:
+        """Check whether the user has access to the state."""
+        return state_id.startswith(self.prefixes)
+
+    @property
+    def is_admin(self) -> bool:
+        """Whether the user has access to all the states."""
+        return "" in self.prefixes
+
+
+def hash_password(password: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> str:
+    """Hash the password with scrypt, e.g. `scrypt$32768$8$1$<salt>$<hash>`."""
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, n, r, p)
+    return "$".join(
+        [
+            "scrypt",
+            str(n),
+            str(r),
+            str(p),
+            base64.b64encode(salt).decode(),
+            base64.b64encode(digest).decode(),
+        ]
+    )
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    """Verify the password against the scrypt or argon2 hash in constant time.
+
+    :raises :class:`ValueError` when the hash is malformed or not supported.
+    """
+    if encoded.startswith("$argon2"):
+        try:
+            import argon2  # noqa: PLC0415
+        except ImportError as err:
+            raise ValueError("The argon2 hashes require the argon2-cffi package.") from err
+        try:
+            return argon2.PasswordHasher().verify(encoded, password)
+        except argon2.exceptions.VerificationError:
+            return False
+
+    n, r, p, salt, expected = _parse_scrypt(encoded)
+    return hmac.compare_digest(_scrypt(password, salt, n, r, p), expected)
+
+
+def check_hash(encoded: str) -> None:
+    """Check the password hash is well-formed and supported.
+
+    :raises :class:`ValueError`
+    """
+    if not encoded.startswith("$argon2"):
+        _parse_scrypt(encoded)
+
+
+def _parse_scrypt(encoded: str) -> tuple[int, int, int, bytes, bytes]:
+    """Parse the scrypt hash into its parameters, salt and digest."""
+    try:
+        scheme, n, r, p, salt, digest = encoded.split("$")
+        if scheme != "scrypt":
+            raise ValueError(f"Unsupported password hash scheme: {scheme}.")
+        return (
+            int(n),
+            int(r),
+            int(p),
+            base64.b64decode(salt, validate=True),
+            base64.b64decode(digest, validate=True),
+        )
+    except binascii.Error as err:
+        raise ValueError(f"Malformed password hash. {err}") from err
+
+
+def _dummy_hash(encoded: str) -> str:
+    """Hash a random password with the scheme and parameters of the `encoded` hash.
+
+    :raises :class:`ValueError` when the hash is malformed or not supported.
+    """
+    password = os.urandom(16).hex()
+    if encoded.startswith("$argon2"):
+        try:
+            import argon2  # noqa: PLC0415
+        except ImportError as err:
+            raise ValueError("The argon2 hashes require the argon2-cffi package.") from err
+        try:
+            parameters = argon2.extract_parameters(encoded)
+        except argon2.exceptions.InvalidHashError as err:
+            raise ValueError(f"Malformed password hash. {err}") from err
+        return argon2.PasswordHasher.from_parameters(parameters).hash(password)
+
+    n, r, p, _, _ = _parse_scrypt(encoded)
+    return hash_password(password, n, r, p)
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n * p, dklen=32
+    )
+
+
+class Authenticator:
+    """
+    The HTTP basic authenticator of the configured users.
+
+    :param users: The users by name, with their password hashes and state ID prefixes.
+    :param cache_size: The maximum number of cached successful verifications.
+    :param cache_ttl: The number of seconds a successful verification is cached.
+    :param max_verifications: The maximum number of concurrent password hash
+        verifications, the number of CPUs when 0.
+    :param queue_timeout: The number of seconds a verification waits for its turn.
+    """
+
+    def __init__(
+        self,
+        users: dict[str, tuple[str, tuple[str, ...]]],
+        cache_size: int,
+        cache_ttl: float,
+        max_verifications: int = 0,
+        queue_timeout: float = 5.0,
+    ) -> None:
+        # Verified for the unknown users, so they take as long as the known ones.
+        # A dummy hash per the scheme and parameters, the fields before the salt.
+        dummy_hashes: dict[str, str] = {}
+        for name, (password_hash, _) in users.items():
+            try:
+                check_hash(password_hash)
+                parameters = password_hash.rsplit("$", 2)[0]
+                if parameters not in dummy_hashes:
+                    dummy_hashes[parameters] = _dummy_hash(password_hash)
+            except ValueError as err:
+                raise ValueError(f"Invalid password hash of the {name} user. {err}") from err
+        self._users = users
+        self._cache: cache.TTLCache[bytes, User] = cache.TTLCache(cache_size, cache_ttl)
+        # The users are fixed, so a rejected header is rejected until it expires.
+        self._rejected: cache.TTLCache[bytes, bool] = cache.TTLCache(cache_size, cache_ttl)
+        self._verifications = threading.BoundedSemaphore(max_verifications or os.cpu_count() or 1)
+        self._queue_timeout = queue_timeout
+        self._key = os.urandom(32)
+        self._dummy_hashes = list(dummy_hashes.values()) or [hash_password(os.urandom(16).hex())]
+
+    def lookup(self, header: str | None) -> User | None:
+        """Get the user of the recently verified `Authorization` header, if any.
+
+        This is the fast path, the slow password hash is not verified.
+        """
+        if not header:
+            return None
+        return self._cache.get(self._digest(header))
+
+    def authenticate(self, header: str | None) -> User:
+        """Authenticate the request by its `Authorization` header.
+
+        The password hash is verified on cache misses, which takes tens of
+        milliseconds, so this should be called in a worker thread.
+
+        :raises :class:`Unauthorized`
+        :raises :class:`Forbidden`
+        :raises :class:`Busy` when the verification does not get its turn in time.
+        """
+        if not header or not header.startswith("Basic "):
+            raise Unauthorized("Basic authentication required.")
+        digest = self._digest(header)
+        if (user := self._cache.get(digest)) is not None:
+            return user
+        if self._rejected.get(digest):
+            raise Forbidden("The username or password is incorrect.")
+
+        try:
+            name, _, password = (
+                base64.b64decode(header[6:].strip(), validate=True).decode().partition(":")
+            )
+        except (binascii.Error, UnicodeDecodeError) as err:
+            raise Unauthorized("Malformed basic authentication credentials.") from err
+
+        password_hash, prefixes = self._users.get(name) or (self._dummy_hash(name), ())
+        if not self._verifications.acquire(timeout=self._queue_timeout):
+            LOG.warning("Too many concurrent authentications.", username=name)
+            raise Busy("Too many concurrent authentications, retry later.")
+        try:
+            verified = verify_password(password, password_hash)
+        finally:
+            self._verifications.release()
+        if not verified or name not in self._users:
+            LOG.warning("Failed authentication.", username=name)
+            self._rejected.set(digest, True)
+            raise Forbidden("The username or password is incorrect.")
+
+        user = User(name, prefixes)
+        self._cache.set(digest, user)
+        return user
+
+    def _dummy_hash(self, name: str) -> str:
+        """The dummy hash of the unknown user, the same one for the same name."""
+        index = int.from_bytes(hmac.digest(self._key, name.encode(), "sha256")[:4])
+        return self._dummy_hashes[index % len(self._dummy_hashes)]
+
+    def _digest(self, header: str) -> bytes:
+        """The cache key of the header, not revealing it and not guessable without the key."""
+        return hmac.digest(self._key, header.encode(), "sha256")
+
+
+def create_default_authenticator() -> Authenticator:
+    """Create the default authenticator of the configured users."""
+    users = {u.name: (u.password_hash, tuple(u.prefixes)) for u in config.users}
+    if config.username and config.password:
+        # The single configured user has access to all the states.
+        users[config.username] = (hash_password(config.password), ("",))
+    return Authenticator(
+        users,
+        config.auth_cache_size,
+        config.auth_cache_ttl,
+        config.auth_max_verifications,
+        config.auth_queue_timeout,
+    )
+
+
+default: Authenticator = lazy_object_proxy.Proxy(create_default_authenticator)
+"""Default authenticator instance (lazy object)."""
@@ -0,0 +1,485 @@
+"""
+The benchmark harness of the HTTP state server.
+
+The harness drives the application in-process through the ASGI interface, with
+the in-memory storage and lock backends injecting a configurable latency in
+place of MinIO, wrapped by the same resilience policy, so the results are
+reproducible and only depend on the server itself. The workers send a weighted mix of the state reads, writes and
+lock/unlock cycles, with the states shaped like the `example/perf` configuration,
+and the results are written as JSON to compare them between the releases.
+"""
+
+import asyncio
+import base64
+import collections
+import contextlib
+import dataclasses
+import gc
+import os
+import platform
+import random
+import re
+import resource
+import threading
+import time
+import typing
+
+import orjson
+
+from src import resilience
+from src import storage
+from src.config import config
+
+__all__ = [
+    "Params",
+    "MemoryStorageBackend",
+    "MemoryLockBackend",
+    "make_state",
+    "parse_size",
+    "run",
+    "compare",
+]
+
+OPERATIONS = ("get", "post", "lock")
+"""The benchmarked operations, the `lock` is a lock and unlock cycle."""
+
+_USERNAME, _PASSWORD = "bench", "bench"
+_SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
+_LONG_STRING = (
+    "      This is a very long string to increase state size. It contains multiple lines\n"
+    "      of text and repeated patterns to make the state file significantly larger.\n"
+    "      Lorem ipsum dolor sit amet, consectetur adipiscing elit. Integer nec odio.\n"
+    "      Praesent libero. Sed cursus ante dapibus diam. Sed nisi. Nulla quis sem at\n"
+    "      nibh elementum imperdiet. Duis sagittis ipsum. Praesent mauris. Fusce nec\n"
+    "      tellus sed augue semper porta. Mauris massa. Vestibulum lacinia arcu eget\n"
+    "      nulla. Class aptent taciti sociosqu ad litora torquent per conubia nostra,\n"
+    "      per inceptos himenaeos. Curabitur sodales ligula in libero. Sed dignissim\n"
+    "      lacinia nunc. Curabitur tortor. Pellentesque nibh. Aenean quam. In scelerisque\n"
+    "      sem at dolor. Maecenas mattis. Sed convallis tristique sem.\n"
+)
+_BIG_MAP = orjson.dumps(
+    {
+        "key1": "value1",
+        "key2": "value2",
+        "key3": "value3",
+        "key4": "value4",
+        "key5": "value5",
+        "nested": {
+            "long_list": [f"item{i}" for i in range(1, 11)],
+            "nested_key1": "nested_value1",
+            "nested_key2": "nested_value2",
+        },
+    }
+).decode()
+
+
+@dataclasses.dataclass(frozen=True)
+class Params:
+    """The benchmark parameters."""
+
+    sizes: tuple[int, ...] = (1024, 1024**2, 10 * 1024**2)
+    """The approximate state sizes in bytes, benchmarked one after another."""
+    requests: int = 200
+    """The number of requests per state size."""
+    concurrency: int = 8
+    """The number of concurrent clients."""
+    mix: dict[str, int] = dataclasses.field(
+        default_factory=lambda: {"get": 70, "post": 25, "lock": 5}
+    )
+    """The weights of the :data:`OPERATIONS`."""
+    latency: float = 0.005
+    """The injected latency of the backend calls in seconds."""
+    jitter: float = 0.002
+    """The maximum random deviation of the injected latency in seconds."""
+    chunking: bool = False
+    """Whether to store the states as content-defined chunks."""
+    seed: int = 0
+    """The seed of the operations mix and the latency jitter."""
+
+
+class MemoryStorageBackend:
+    """The in-memory storage backend with the injected latency."""
+
+    name = "memory"
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: int = 0) -> None:
+        self._objects: dict[str, bytes] = {}
+        self._latency = latency
+        self._jitter = jitter
+        self._random = random.Random(seed)  # noqa: S311
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes:
+        """Fetch data for the given `key`."""
+        self._sleep()
+        try:
+            return self._objects[key]
+        except KeyError:
+            raise storage.NotFound(f"The {key} object not found.")
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        """Fetch `length` bytes of data for the given `key` starting at `offset`."""
+        return self.get(key)[offset : offset + length]
+
+    def create(self, key: str, data: bytes) -> None:
+        """Save `data` to the given `key`."""
+        self._sleep()
+        self._objects[key] = bytes(data)
+
+    def delete(self, key: str) -> None:
+        """Delete data by `key`."""
+        self._sleep()
+        if self._objects.pop(key, None) is None:
+            raise storage.NotFound(f"The {key} object not found.")
+
+    def exists(self, key: str) -> bool:
+        """Check whether the data for the given `key` exists."""
+        self._sleep()
+        return key in self._objects
+
+    def list_objects(self, prefix: str = "") -> list[storage.ObjectInfo]:
+        """List the objects with keys starting with `prefix`."""
+        self._sleep()
+        return [
+            storage.ObjectInfo(key, len(data), None)
+            for key, data in sorted(self._objects.items())
+            if key.startswith(prefix)
+        ]
+
+    def _sleep(self) -> None:
+        if self._latency or self._jitter:
+            with self._lock:
+                jitter = self._random.uniform(-self._jitter, self._jitter)
+            time.sleep(max(self._latency + jitter, 0))
+
+
+class MemoryLockBackend:
+    """The in-memory lock backend, storing the locks in the storage backend like MinIO does."""
+
+    name = "memory"
+
+    def __init__(self, backend: MemoryStorageBackend) -> None:
+        self._storage = backend
+        self._lock = threading.Lock()
+
+    def lock(self, key: str, lock_info: typing.Any) -> None:  # noqa: ANN401
+        """Lock the given `key`."""
+        from src import lock  # noqa: PLC0415
+
+        with self._lock:
+            try:
+                existing = orjson.loads(self._storage.get(f"{key}.lock"))
+            except storage.NotFound:
+                self._storage.create(f"{key}.lock", orjson.dumps(lock_info))
+                return
+        raise lock.AlreadyLocked(f"The {key} has lock with ID {existing.get('id')}.", existing)
+
+    def unlock(self, key: str) -> typing.Any:  # noqa: ANN401
+        """Unlock the given `key`."""
+        from src import lock  # noqa: PLC0415
+
+        with self._lock:
+            try:
+                lock_info = orjson.loads(self._storage.get(f"{key}.lock"))
+                self._storage.delete(f"{key}.lock")
+            except storage.NotFound:
+                raise lock.NotLocked(f"The {key} lock not acquired.")
+        return lock_info
+
+
+def make_state(size: int, serial: int = 1) -> bytes:
+    """Build a state of about `size` bytes shaped like the `example/perf` configuration."""
+
+    def instance(i: int) -> dict[str, typing.Any]:
+        return {
+            "schema_version": 0,
+            "attributes": {
+                "id": f"{7_000_000_000_000_000_000 + i}",
+                "triggers": {
+                    "always_run": "2025-02-24T10:00:00Z",
+                    "big_map": _BIG_MAP,
+                    "id": str(i),
+                    "long_string": _LONG_STRING,
+                },
+            },
+            "sensitive_attributes": [],
+            "index_key": i,
+        }
+
+    def state(count: int) -> bytes:
+        return orjson.dumps(
+            {
+                "version": 4,
+                "terraform_version": "1.9.0",
+                "serial": serial,
+                "lineage": "c0ffee00-0000-4000-8000-000000000000",
+                "outputs": {},
+                "resources": [
+                    {
+                        "mode": "managed",
+                        "type": "null_resource",
+                        "name": "dummy",
+                        "provider": 'provider["registry.opentofu.org/hashicorp/null"]',
+                        "instances": [instance(i) for i in range(count)],
+                    }
+                ],
+                "check_results": None,
+            },
+            option=orjson.OPT_INDENT_2,
+        )
+
+    empty, one = len(state(0)), len(state(1))
+    return state(max(round((size - empty) / (one - empty)), 1))
+
+
+def parse_size(value: str) -> int:
+    """Parse the size like `100KB` into bytes.
+
+    :raises :class:`ValueError`
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?B?)\s*", value.upper())
+    if not match:
+        raise ValueError(f"Invalid size: {value}.")
+    return int(match[1]) * _SIZE_UNITS[match[2] if match[2] != "K" else "KB"]
+
+
+def run(params: Params) -> dict[str, typing.Any]:
+    """Run the benchmark and return the results."""
+    os.environ.setdefault("TOFU_HTTP_MINIO_ACCESS_KEY", "bench")
+    os.environ.setdefault("TOFU_HTTP_MINIO_SECRET_KEY", "bench")
+    os.environ.setdefault("TOFU_HTTP_LOG_LEVEL", "warning")
+    from src.cmd import app  # noqa: PLC0415
+
+    results = []
+    for size in params.sizes:
+        with _backends(params):
+            gc.collect()
+            results.append(asyncio.run(_run_size(app, params, size)))
+    return {
+        "params": dataclasses.asdict(params),
+        "python": platform.python_version(),
+        "platform": platform.platform(terse=True),
+        "results": results,
+    }
+
+
+def compare(old: dict[str, typing.Any], new: dict[str, typing.Any]) -> list[str]:
+    """Compare two benchmark results, the relative changes of the new ones."""
+
+    def change(a: float, b: float) -> str:
+        return f"{b:10.3f} ({(b - a) / a * 100:+6.1f}%)" if a else f"{b:10.3f}"
+
+    lines = []
+    old_results = {r["size"]: r for r in old["results"]}
+    for result in new["results"]:
+        if (base := old_results.get(result["size"])) is None:
+            continue
+        rps = change(base["throughput_rps"], result["throughput_rps"])
+        rss = change(base["peak_rss_mb"], result["peak_rss_mb"])
+        lines.append(f"size={result['size']}  rps={rps}  peak_rss_mb={rss}")
+        for op, stats in result["ops"].items():
+            if (base_stats := base["ops"].get(op)) is None:
+                continue
+            p50 = change(base_stats["p50_ms"], stats["p50_ms"])
+            p99 = change(base_stats["p99_ms"], stats["p99_ms"])
+            lines.append(f"  {op:<8} p50_ms={p50}  p99_ms={p99}")
+    return lines
+
+
+@contextlib.contextmanager
+def _backends(params: Params) -> typing.Iterator[None]:
+    """Replace the default backends with the in-memory ones, restore them on exit.
+
+    The in-memory backends are wrapped as the default ones, so the resilience
+    policy and the chunking are measured as well.
+    """
+    from src import admission  # noqa: PLC0415
+    from src import auth  # noqa: PLC0415
+    from src import lock  # noqa: PLC0415
+    from src.app.state import catalog  # noqa: PLC0415
+
+    memory = MemoryStorageBackend(params.latency, params.jitter, params.seed)
+    backend: storage.StorageBackend = storage.ResilientStorageBackend(
+        memory, resilience.default_policy()
+    )
+    if params.chunking:
+        backend = storage.ChunkedStorageBackend(
+            backend, config.storage_chunk_size, config.storage_chunks_gc_grace
+        )
+    replaced: list[tuple[typing.Any, typing.Any]] = [
+        (storage, backend),
+        (lock, lock.ResilientLockBackend(MemoryLockBackend(memory), resilience.default_policy())),
+        (catalog, catalog.Catalog()),
+        (admission, admission.create_default_limiter()),
+        (
+            auth,
+            auth.Authenticator(
+                {_USERNAME: (auth.hash_password(_PASSWORD, n=2**4), ("",))}, 10, 3600
+            ),
+        ),
+    ]
+    originals = [(module, module.__dict__["default"]) for module, _ in replaced]
+    for module, default in replaced:
+        module.default = default
+    try:
+        yield
+    finally:
+        for module, default in originals:
+            module.default = default
+
+
+async def _run_size(app: typing.Any, params: Params, size: int) -> dict[str, typing.Any]:  # noqa: ANN401
+    """Benchmark the states of about `size` bytes."""
+    from src import admission  # noqa: PLC0415
+
+    body = make_state(size)
+    rng = random.Random(params.seed)  # noqa: S311
+    ops = rng.choices(list(params.mix), weights=list(params.mix.values()), k=params.requests)
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    for op in ops:
+        queue.put_nowait(op)
+
+    samples: dict[str, list[float]] = collections.defaultdict(list)
+    errors: collections.Counter[str] = collections.Counter()
+
+    async def worker(i: int) -> None:
+        state_id = f"bench/{size}/{i}"
+        client = (f"10.0.{i // 256}.{i % 256}", 40000 + i)
+        serial = 1
+        await _request(app, "POST", f"/state/{state_id}", body, client)
+        while not queue.empty():
+            op = queue.get_nowait()
+            if op == "get":
+                calls = [("get", "GET", f"/state/{state_id}", b"")]
+            elif op == "post":
+                serial += 1
+                data = body.replace(b'"serial": 1,', f'"serial": {serial},'.encode(), 1)
+                calls = [("post", "POST", f"/state/{state_id}", data)]
+            else:
+                lock_info = orjson.dumps(
+                    {
+                        "ID": f"{i}-{serial}",
+                        "Operation": "OperationTypeApply",
+                        "Who": f"bench@{i}",
+                        "Version": "1.9.0",
+                        "Created": "2025-02-24T10:00:00Z",
+                    }
+                )
+                calls = [
+                    ("lock", "POST", f"/state/lock/{state_id}", lock_info),
+                    ("unlock", "POST", f"/state/unlock/{state_id}", b""),
+                ]
+            for name, method, path, data in calls:
+                status, elapsed = await _request(app, method, path, data, client)
+                samples[name].append(elapsed)
+                if status >= 400:  # noqa: PLR2004
+                    errors[name] += 1
+
+    _reset_peak_rss()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(params.concurrency)))
+    duration = time.perf_counter() - started
+    # The state projections must not outlive the replaced backends.
+    await admission.default.drain()
+
+    return {
+        "size": size,
+        "state_bytes": len(body),
+        "requests": sum(len(s) for s in samples.values()),
+        "errors": sum(errors.values()),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(sum(len(s) for s in samples.values()) / duration, 3),
+        "peak_rss_mb": round(_peak_rss() / 1024**2, 3),
+        "ops": {
+            name: {"count": len(values), "errors": errors[name], **_percentiles(values)}
+            for name, values in sorted(samples.items())
+        },
+    }
+
+
+async def _request(
+    app: typing.Any,  # noqa: ANN401
+    method: str,
+    path: str,
+    body: bytes,
+    client: tuple[str, int],
+) -> tuple[int, float]:
+    """Send the request to the ASGI app, return the status and the response time."""
+    token = base64.b64encode(f"{_USERNAME}:{_PASSWORD}".encode()).decode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"bench"),
+            (b"authorization", f"Basic {token}".encode()),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": client,
+        "server": ("bench", 80),
+    }
+    sent = False
+    disconnected = asyncio.Event()
+    response: dict[str, typing.Any] = {}
+
+    async def receive() -> dict[str, typing.Any]:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict[str, typing.Any]) -> None:
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            # The background tasks run after the response is sent.
+            response.setdefault("elapsed", time.perf_counter() - started)
+
+    started = time.perf_counter()
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    return response["status"], response.get("elapsed", time.perf_counter() - started)
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    """The latency percentiles in milliseconds."""
+    values = sorted(values)
+
+    def percentile(q: float) -> float:
+        return round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 3)
+
+    return {
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+def _reset_peak_rss() -> None:
+    """Reset the peak RSS of the process, where it is supported (Linux)."""
+    with contextlib.suppress(OSError):
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+
+
+def _peak_rss() -> int:
+    """The peak RSS of the process in bytes, since the last reset where it is supported."""
+    with contextlib.suppress(OSError):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
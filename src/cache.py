@@ -0,0 +1,65 @@
+"""
+The in-process caches.
+"""
+
+import collections
+import threading
+import time
+import typing
+
+__all__ = ["TTLCache"]
+
+
+class TTLCache[K, V]:
+    """
+    The thread-safe LRU cache with expiring entries.
+
+    :param maxsize: The maximum number of entries, the least recently used
+        entries are evicted first.
+    :param ttl: The number of seconds an entry stays valid.
+    """
+
+    def __init__(
+        self, maxsize: int, ttl: float, clock: typing.Callable[[], float] = time.monotonic
+    ) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._clock = clock
+        self._data: collections.OrderedDict[K, tuple[float, V]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> V | None:
+        """Get the value of `key`, if it is cached and not expired."""
+        with self._lock:
+            if (entry := self._data.get(key)) is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: K, value: V) -> None:
+        """Cache the `value` of `key`."""
+        with self._lock:
+            self._set(key, value)
+
+    def add(self, key: K, value: V) -> None:
+        """Cache the `value` of `key`, unless it is already cached and not expired."""
+        with self._lock:
+            if (entry := self._data.get(key)) is None or entry[0] <= self._clock():
+                self._set(key, value)
+
+    def pop(self, key: K) -> None:
+        """Remove `key` from the cache."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _set(self, key: K, value: V) -> None:
+        self._data[key] = (self._clock() + self._ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
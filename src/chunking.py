@@ -0,0 +1,62 @@
+"""
+The content-defined chunking of the state bodies.
+
+The chunk boundaries are chosen by the content itself, so inserting or removing
+a resource only changes the chunks around it, and the rest of the chunks are
+shared by the successive serials of a state and by the similar states.
+
+The state bodies are indented JSON documents, so the candidate boundaries are
+the line ends (or the commas for the minified documents). A candidate becomes a
+boundary depending on the CRC-32 of the :data:`WINDOW` bytes preceding it, with
+the probability proportional to the length of the line, so the average chunk
+size does not depend on the line lengths. Evaluating the rolling window at the
+anchors only keeps the hashing in C, instead of a per-byte hash loop in Python.
+"""
+
+import zlib
+
+__all__ = ["split", "DEFAULT_AVG_SIZE", "WINDOW"]
+
+DEFAULT_AVG_SIZE = 16 * 1024
+"""The default average chunk size in bytes."""
+
+WINDOW = 64
+"""The number of bytes preceding a candidate boundary which decide on it."""
+
+
+def split(data: bytes, avg_size: int = DEFAULT_AVG_SIZE) -> list[memoryview]:
+    """Split `data` into the content-defined chunks.
+
+    The chunks are at least `avg_size / 4` (except the last one) and
+    at most `avg_size * 4` bytes long.
+    """
+    min_size, max_size = avg_size // 4, avg_size * 4
+    sep = b"\n" if data.count(b"\n") * avg_size >= len(data) * 16 else b","
+    view = memoryview(data)
+    chunks: list[memoryview] = []
+
+    start = 0
+    pos = data.find(sep, start + min_size)
+    while pos != -1:
+        end = pos + 1
+        if end - start > max_size:
+            chunks.append(view[start : start + max_size])
+            start += max_size
+            pos = data.find(sep, start + min_size)
+            continue
+        # The boundary depends on the content preceding it only, not on
+        # the chunk start, so the chunks resynchronize after a change.
+        line = end - data.rfind(sep, 0, pos) - 1
+        if zlib.crc32(view[max(end - WINDOW, 0) : end]) % avg_size < line:
+            chunks.append(view[start:end])
+            start = end
+            pos = data.find(sep, start + min_size)
+        else:
+            pos = data.find(sep, end)
+
+    while len(data) - start > max_size:
+        chunks.append(view[start : start + max_size])
+        start += max_size
+    if start < len(data):
+        chunks.append(view[start:])
+    return chunks
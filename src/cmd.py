@@ -7,6 +7,7 @@ import pydantic_core
 from src import config
 from src import log
 from src import middlewares
+from src.app import admin
 from src.app import state
 
 dotenv.load_dotenv()
@@ -29,3 +30,4 @@ app = fastapi.FastAPI()
 app.add_middleware(middlewares.StateAuthnMiddleware)
 app.add_middleware(middlewares.LogMiddleware)
 app.include_router(state.api.router)
+app.include_router(admin.api.router)
@@ -3,6 +3,7 @@ import pathlib
 import typing
 
 import lazy_object_proxy
+from pydantic import BaseModel
 from pydantic import Field
 from pydantic import model_validator
 from pydantic_settings import BaseSettings
@@ -15,6 +16,16 @@ DEFAULT_MINIO_BUCKET = "e1cc89bb-b9f5-4b29-8163-c3e8da21bbba"
 """Default bucked in a MinIO storage."""
 
 
+class UserCredentials(BaseModel):
+    """The credentials of an HTTP basic authentication user."""
+
+    name: str = Field(description="The username.")
+    password_hash: str = Field(description="The scrypt or argon2 password hash.")
+    prefixes: list[str] = Field(
+        default=[""], description="The state ID prefixes the user has access to."
+    )
+
+
 class Config(BaseSettings):
     """The application configuration."""
 
@@ -30,14 +41,115 @@ class Config(BaseSettings):
     password: str | None = Field(
         default=None, description="The password for HTTP basic authentication"
     )
+    users: list[UserCredentials] = Field(
+        default_factory=list, description="The HTTP basic authentication users."
+    )
+    auth_cache_size: int = Field(
+        default=10000, ge=0, description="The maximum number of cached verified credentials."
+    )
+    auth_cache_ttl: float = Field(
+        default=60.0, ge=0, description="The seconds a verified credential stays cached."
+    )
+    auth_max_verifications: int = Field(
+        default=0,
+        ge=0,
+        description="The maximum concurrent password hash verifications (0 for the CPU count).",
+    )
+    auth_queue_timeout: float = Field(
+        default=5.0, ge=0, description="The seconds a password hash verification waits its turn."
+    )
 
     storage_backend: typing.Literal["minio"] = Field(
         default="minio", description="The remote storage backend used for storing state files."
     )
+    storage_chunking: bool = Field(
+        default=False,
+        description="Whether to store the states as deduplicated content-defined chunks.",
+    )
+    storage_chunk_size: int = Field(
+        default=16 * 1024, ge=1024, description="The average chunk size in bytes."
+    )
+    storage_chunks_gc_grace: float = Field(
+        default=3600.0,
+        ge=0,
+        description="The seconds a chunk is kept by the garbage collection after its last write.",
+    )
     lock_backend: typing.Literal["minio"] = Field(
         default="minio", description="The remote storage backend used for state file locking."
     )
 
+    # Backends resilience config.
+    backend_timeout: float = Field(
+        default=10.0,
+        gt=0,
+        description="The deadline in seconds for a single backend operation, including retries.",
+    )
+    backend_retries: int = Field(
+        default=2, ge=0, description="The number of retries for idempotent backend operations."
+    )
+    backend_retry_backoff: float = Field(
+        default=0.05, ge=0, description="The base delay in seconds for the jittered backoff."
+    )
+    backend_hedge_quantile: float = Field(
+        default=0.95,
+        ge=0,
+        lt=1,
+        description="The latency quantile after which a hedged read is sent (0 disables).",
+    )
+    backend_breaker_threshold: int = Field(
+        default=5, ge=1, description="The consecutive failures which open the circuit breaker."
+    )
+    backend_breaker_reset: float = Field(
+        default=30.0, gt=0, description="The seconds an open circuit breaker fails fast."
+    )
+
+    # State history config.
+    history_enabled: bool = Field(
+        default=True, description="Whether to record the version history of the states."
+    )
+    history_snapshot_interval: int = Field(
+        default=20, ge=1, description="The maximum number of deltas between two full snapshots."
+    )
+    history_max_versions: int = Field(
+        default=100, ge=1, description="The maximum number of recorded versions per state."
+    )
+    history_max_bytes: int = Field(
+        default=256 * 1024 * 1024,
+        ge=0,
+        description="The maximum total stored bytes of the recorded versions per state.",
+    )
+
+    # State outputs config.
+    outputs_cache_size: int = Field(
+        default=10000, ge=0, description="The maximum number of cached state outputs."
+    )
+    outputs_cache_ttl: float = Field(
+        default=5.0, ge=0, description="The seconds a cached state outputs entry stays valid."
+    )
+
+    # States catalog config.
+    catalog_refresh_interval: float = Field(
+        default=30.0,
+        ge=0,
+        description="The seconds after which the states catalog is reloaded from the storage.",
+    )
+
+    # Admission control config.
+    max_state_size: int = Field(
+        default=256 * 1024 * 1024, ge=1, description="The maximum state body size in bytes."
+    )
+    admission_budget: int = Field(
+        default=512 * 1024 * 1024,
+        ge=0,
+        description="The maximum total bytes of the in-flight state payloads (0 disables).",
+    )
+    admission_queue_timeout: float = Field(
+        default=10.0, ge=0, description="The seconds a request waits for the payload budget."
+    )
+    admission_client_limit: int = Field(
+        default=0, ge=0, description="The maximum in-flight requests per user (0 disables)."
+    )
+
     # Minio connection config.
     minio_host: str = Field(default="play.min.io", description="The MinIO host.")
     minio_bucket: str = Field(
@@ -3,6 +3,7 @@ The remote locking backend for the HTTP state server.
 """
 
 import typing
+from collections.abc import Callable
 from typing import Protocol
 from typing import TypedDict
 
@@ -11,13 +12,16 @@ import orjson
 
 from src import errors
 from src import log
+from src import resilience
 from src import storage
 from src.config import config
 
-__all__ = ["default", "Error", "NotFound", "AlreadyLocked", "NotLocked"]
+__all__ = ["default", "Error", "NotFound", "AlreadyLocked", "NotLocked", "Unavailable"]
 
 LOG = log.get_logger(__name__)
 
+T = typing.TypeVar("T")
+
 
 class Error(errors.Error):
     """The locking backend error."""
@@ -42,6 +46,17 @@ class NotLocked(Error):
     """Raised when the requested object ID is not locked."""
 
 
+class Unavailable(Error):
+    """Raised when the backend call timed out or the backend is failing fast."""
+
+    def __init__(self, msg: str, retry_after: float = 1.0) -> None:
+        """
+        :param retry_after: The number of seconds after which the call may succeed.
+        """
+        self.retry_after = retry_after
+        super().__init__(msg)
+
+
 class LockInfo(TypedDict):
     """Represents the minimal set of fields for lock lock_info."""
 
@@ -145,11 +160,41 @@ class MinioLockBackend:
             raise Error("Cannot decode the lock lock_info. %s", str(err))
 
 
+class ResilientLockBackend:
+    """
+    Lock Backend wrapper applying the :mod:`src.resilience` policy to another backend.
+
+    Locking is a read-modify-write sequence, which is not idempotent, so the
+    calls get the deadline and the circuit breaker, but are never retried or hedged.
+    """
+
+    def __init__(self, backend: LockBackend, policy: resilience.Policy) -> None:
+        self.name = backend.name
+        self._backend = backend
+        self._guard = resilience.Guard(
+            backend.name, policy, failures=(Error,), ignore=(NotFound, AlreadyLocked, NotLocked)
+        )
+
+    def lock(self, key: str, lock_info: LockInfo) -> None:
+        """Lock the given `key`."""
+        self._call(self._backend.lock, key, lock_info)
+
+    def unlock(self, key: str) -> LockInfo:
+        """Unlock the given `key`."""
+        return self._call(self._backend.unlock, key)
+
+    def _call(self, fn: Callable[..., T], *args: object) -> T:
+        try:
+            return self._guard.call(fn, *args)
+        except resilience.Error as err:
+            raise Unavailable(str(err), retry_after=err.retry_after) from err
+
+
 def create_default_backend() -> LockBackend:
     """Create the default lock backend."""
     match b := config.lock_backend:
         case "minio":
-            return MinioLockBackend()
+            return ResilientLockBackend(MinioLockBackend(), resilience.default_policy())
         case _:
             raise ValueError(f"Unsupported lock backend: {b}")
 
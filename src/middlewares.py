@@ -1,26 +1,30 @@
-import base64
-import functools
 import time
 import uuid
 
 import fastapi
 import structlog.contextvars
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware import base
 from uvicorn.protocols import utils
 
+from src import auth
 from src import log
-from src.config import config
 
 __all__ = ["LogMiddleware", "StateAuthnMiddleware"]
 
 LOG_ACCESS = log.get_logger("api.access")
 LOG_ERROR = log.get_logger("api.error")
 
-
-@functools.lru_cache
-def _build_auth_token() -> str:
-    """Build the HTTP basic authentication token from config credentials."""
-    return base64.b64encode(f"{config.username}:{config.password}".encode()).decode()
+AUTHENTICATED_PREFIXES = (
+    "/state",
+    "/catalog",
+    "/outputs",
+    "/resources",
+    "/versions",
+    "/version",
+    "/admin",
+)
+"""The paths requiring the authentication, with all the paths under them."""
 
 
 class LogMiddleware(base.BaseHTTPMiddleware):
@@ -69,18 +73,33 @@ class LogMiddleware(base.BaseHTTPMiddleware):
 
 
 class StateAuthnMiddleware(base.BaseHTTPMiddleware):
-    """The HTTP basic authentication middleware for `/state/*` endpoints."""
+    """
+    The HTTP basic authentication middleware for the :data:`AUTHENTICATED_PREFIXES` endpoints.
+
+    The authenticated :class:`auth.User` is stored as `request.state.user`,
+    the endpoints authorize the access to the states by it.
+    """
 
     async def dispatch(
         self, request: fastapi.Request, call_next: base.RequestResponseEndpoint
     ) -> fastapi.Response:
-        if request.url.path.startswith("/state/"):
-            if not ((h := request.headers.get("Authorization")) and h.startswith("Basic ")):
-                return fastapi.Response(
-                    status_code=401, content="Unauthorized. Basic authentication required."
+        path = request.url.path
+        if any(path == p or path.startswith(f"{p}/") for p in AUTHENTICATED_PREFIXES):
+            header = request.headers.get("Authorization")
+            try:
+                # The recently verified credentials are checked in place, the slow
+                # password hashes are verified in a worker thread.
+                request.state.user = auth.default.lookup(header) or await run_in_threadpool(
+                    auth.default.authenticate, header
                 )
-            if h.removeprefix("Basic").strip() != _build_auth_token():
+            except auth.Unauthorized as err:
+                return fastapi.Response(status_code=401, content=f"Unauthorized. {err}")
+            except auth.Forbidden as err:
+                return fastapi.Response(status_code=403, content=f"Forbidden. {err}")
+            except auth.Busy as err:
                 return fastapi.Response(
-                    status_code=403, content="Forbidden. The username or password is incorrect."
+                    status_code=503,
+                    content=f"Service Unavailable. {err}",
+                    headers={"Retry-After": "1"},
                 )
         return await call_next(request)
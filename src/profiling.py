@@ -0,0 +1,273 @@
+"""
+The on-demand profiling of the live worker.
+
+The profiles are collected for a given number of seconds, without restarting
+the worker, and cost nothing while they are not running:
+
+- The sampling profiler periodically captures the stacks of all the threads,
+  the request handlers on the event loop and the blocking backend calls in the
+  thread pool alike, and counts them as collapsed stacks (`thread;frame;... N`),
+  which are consumed by the flamegraph tools as-is.
+- The allocations tracer compares the `tracemalloc` snapshots taken at the start
+  and the end, which shows the code holding on to more memory after the run.
+- The event loop monitor measures how late the scheduled callbacks run, and a
+  watchdog thread captures the stack of the event loop thread while it is
+  blocked for longer than the threshold, which shows the blocking code.
+"""
+
+import asyncio
+import collections
+import contextlib
+import dataclasses
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+
+from src import errors
+from src import log
+
+__all__ = [
+    "Error",
+    "Busy",
+    "Allocation",
+    "SlowCallback",
+    "LoopReport",
+    "sample_stacks",
+    "collapse",
+    "trace_allocations",
+    "monitor_loop",
+]
+
+LOG = log.get_logger(__name__)
+
+IDLE_FRAMES = {
+    ("threading", "wait"),
+    ("queue", "get"),
+    ("selectors", "select"),
+    ("asyncio.runners", "run"),
+}
+"""The leaf frames of the threads waiting for work, as module and function names."""
+
+_cpu_lock = threading.Lock()
+_memory_lock = threading.Lock()
+_loop_lock = threading.Lock()
+
+
+class Error(errors.Error):
+    """The profiling error."""
+
+
+class Busy(Error):
+    """Raised when the same kind of profile is already running."""
+
+
+@dataclasses.dataclass(frozen=True)
+class Allocation:
+    """The memory allocated by the code location, and its change during the run."""
+
+    traceback: list[str]
+    """The allocating frames as `file:line`, the most recent last."""
+    size: int
+    size_diff: int
+    count: int
+    count_diff: int
+
+
+@dataclasses.dataclass(frozen=True)
+class SlowCallback:
+    """The event loop was blocked by a callback for longer than the threshold."""
+
+    at: float
+    """The number of seconds since the monitoring start."""
+    duration_ms: float
+    stack: list[str]
+    """The stack of the event loop thread while it was blocked, the most recent last."""
+
+
+@dataclasses.dataclass(frozen=True)
+class LoopReport:
+    """The event loop lag, how late the scheduled callbacks run."""
+
+    samples: int
+    mean_ms: float
+    p50_ms: float
+    p99_ms: float
+    max_ms: float
+    slow_callbacks: list[SlowCallback]
+
+
+def sample_stacks(
+    seconds: float,
+    interval: float = 0.01,
+    idle: bool = False,  # noqa: FBT001, FBT002
+) -> dict[str, int]:
+    """Sample the stacks of all the threads for `seconds`, blocking the calling thread.
+
+    :param interval: The number of seconds between the samples.
+    :param idle: Whether to count the threads waiting for work.
+    :return: The number of samples by the collapsed stack, the thread name first.
+    :raises :class:`Busy`
+    """
+    counts: collections.Counter[str] = collections.Counter()
+    with _exclusive(_cpu_lock, "CPU"):
+        sampler = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while (started := time.monotonic()) < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # noqa: SLF001
+                if ident == sampler or (not idle and _is_idle(frame)):
+                    continue
+                counts[";".join([names.get(ident, str(ident)), *_stack(frame)])] += 1
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+    return dict(counts)
+
+
+def collapse(counts: dict[str, int]) -> str:
+    """Format the sampled stacks in the collapsed format, one `stack count` per line."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+def trace_allocations(
+    seconds: float,
+    limit: int = 20,
+    frames: int = 1,
+    group_by: typing.Literal["filename", "lineno", "traceback"] = "lineno",
+) -> list[Allocation]:
+    """Trace the allocations for `seconds`, blocking the calling thread.
+
+    :param limit: The number of the top allocating locations.
+    :param frames: The number of the frames stored per allocation.
+    :param group_by: Group the allocations by `filename`, `lineno` or `traceback`.
+    :return: The top allocating locations by the allocated size change.
+    :raises :class:`Busy`
+    """
+    with _exclusive(_memory_lock, "memory"):
+        # The tracing started outside, e.g. by PYTHONTRACEMALLOC, is left running.
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(frames)
+        try:
+            before = _snapshot()
+            time.sleep(seconds)
+            after = _snapshot()
+        finally:
+            if started:
+                tracemalloc.stop()
+    return [
+        Allocation(
+            traceback=[f"{f.filename}:{f.lineno}" for f in stat.traceback],
+            size=stat.size,
+            size_diff=stat.size_diff,
+            count=stat.count,
+            count_diff=stat.count_diff,
+        )
+        for stat in after.compare_to(before, group_by)[:limit]
+    ]
+
+
+async def monitor_loop(
+    seconds: float, interval: float = 0.05, threshold: float = 0.1
+) -> LoopReport:
+    """Monitor the running event loop lag for `seconds`.
+
+    :param interval: The number of seconds between the lag measurements.
+    :param threshold: The lag of the slow callbacks in seconds.
+    :raises :class:`Busy`
+    """
+    with _exclusive(_loop_lock, "event loop"):
+        watchdog = _Watchdog(threading.get_ident(), interval + threshold)
+        lags: list[float] = []
+        slow: list[SlowCallback] = []
+        started = time.monotonic()
+        watchdog.start()
+        try:
+            while (beat := time.monotonic()) - started < seconds:
+                watchdog.beat = beat
+                await asyncio.sleep(interval)
+                lags.append(lag := max(time.monotonic() - beat - interval, 0))
+                stack, watchdog.stack = watchdog.stack, None
+                if stack is not None or lag >= threshold:
+                    # A callback shorter than the watchdog period has no stack.
+                    slow.append(SlowCallback(round(beat - started, 3), _ms(lag), stack or []))
+        finally:
+            watchdog.stop()
+
+    if slow:
+        LOG.warning("Detected slow event loop callbacks.", count=len(slow))
+    lags.sort()
+    return LoopReport(
+        samples=len(lags),
+        mean_ms=_ms(sum(lags) / len(lags)) if lags else 0,
+        p50_ms=_ms(lags[int(0.5 * len(lags))]) if lags else 0,
+        p99_ms=_ms(lags[min(int(0.99 * len(lags)), len(lags) - 1)]) if lags else 0,
+        max_ms=_ms(lags[-1]) if lags else 0,
+        slow_callbacks=slow,
+    )
+
+
+class _Watchdog(threading.Thread):
+    """Captures the stack of the event loop thread, when it misses a heartbeat."""
+
+    def __init__(self, loop_thread: int, timeout: float) -> None:
+        super().__init__(name="loop-watchdog", daemon=True)
+        self.beat = time.monotonic()
+        self.stack: list[str] | None = None
+        self._loop_thread = loop_thread
+        self._timeout = timeout
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        captured = None
+        while not self._stopped.wait(self._timeout / 4):
+            beat = self.beat
+            if beat != captured and time.monotonic() - beat > self._timeout:
+                frame = sys._current_frames().get(self._loop_thread)  # noqa: SLF001
+                self.stack = _stack(frame) if frame else []
+                captured = beat
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+@contextlib.contextmanager
+def _exclusive(lock: threading.Lock, kind: str) -> typing.Iterator[None]:
+    """Run a single profile of the kind at once."""
+    if not lock.acquire(blocking=False):
+        raise Busy(f"The {kind} profile is already running.")
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def _stack(frame: typing.Any) -> list[str]:  # noqa: ANN401
+    """The frames of the stack as `function (module:line)`, the most recent last."""
+    stack = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", frame.f_code.co_filename)
+        stack.append(f"{frame.f_code.co_qualname} ({module}:{frame.f_lineno})")
+        frame = frame.f_back
+    return stack[::-1]
+
+
+def _is_idle(frame: typing.Any) -> bool:  # noqa: ANN401
+    """Check whether the thread is waiting for work by its leaf frame."""
+    return (frame.f_globals.get("__name__"), frame.f_code.co_name) in IDLE_FRAMES
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    """Take the snapshot of the traced allocations, without the tracing own ones."""
+    return tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(inclusive=False, filename_pattern=tracemalloc.__file__),
+            tracemalloc.Filter(inclusive=False, filename_pattern="<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(inclusive=False, filename_pattern="<unknown>"),
+        )
+    )
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
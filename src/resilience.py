@@ -0,0 +1,325 @@
+"""
+The resilience layer for the remote backends calls.
+
+Every call made through a :class:`Guard` gets a per-operation deadline, bounded
+retries with jittered exponential backoff (for idempotent operations only),
+hedged duplicate requests once the call is slower than the observed latency
+percentile of the calls of a similar size, and a circuit breaker that fails
+fast while the backend is down.
+"""
+
+import collections
+import dataclasses
+import functools
+import random
+import threading
+import time
+import typing
+from concurrent import futures
+
+from src import errors
+from src import log
+from src.config import config
+
+__all__ = ["Error", "DeadlineExceeded", "CircuitOpen", "Policy", "CircuitBreaker", "Guard"]
+
+LOG = log.get_logger(__name__)
+
+T = typing.TypeVar("T")
+
+
+class Error(errors.Error):
+    """The resilience layer error."""
+
+    def __init__(self, msg: str, retry_after: float = 0.0) -> None:
+        """
+        :param retry_after: The number of seconds after which the call may succeed.
+        """
+        self.retry_after = retry_after
+        super().__init__(msg)
+
+
+class DeadlineExceeded(Error):
+    """Raised when the operation did not complete before its deadline."""
+
+
+class CircuitOpen(Error):
+    """Raised when the circuit breaker rejects the call without trying it."""
+
+
+@dataclasses.dataclass(frozen=True)
+class Policy:
+    """The resilience settings applied to a single backend."""
+
+    timeout: float = 10.0
+    """The deadline in seconds for an operation, including all retries."""
+    retries: int = 2
+    """The number of retries for idempotent operations."""
+    backoff_base: float = 0.05
+    """The base delay in seconds for the exponential backoff."""
+    backoff_cap: float = 1.0
+    """The maximum delay in seconds between two attempts."""
+    hedge_quantile: float = 0.95
+    """The latency quantile after which a hedged request is sent. Zero disables hedging."""
+    hedge_min_samples: int = 20
+    """The number of latency samples required before hedging starts."""
+    breaker_threshold: int = 5
+    """The number of consecutive failures which opens the circuit breaker."""
+    breaker_reset: float = 30.0
+    """The number of seconds the circuit breaker stays open before a trial call."""
+
+
+def default_policy() -> Policy:
+    """Build the resilience policy from the application config."""
+    return Policy(
+        timeout=config.backend_timeout,
+        retries=config.backend_retries,
+        backoff_base=config.backend_retry_backoff,
+        hedge_quantile=config.backend_hedge_quantile,
+        breaker_threshold=config.backend_breaker_threshold,
+        breaker_reset=config.backend_breaker_reset,
+    )
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Compute the "full jitter" backoff delay for the given zero-based attempt."""
+    return random.uniform(0, min(cap, base * 2**attempt))  # noqa: S311
+
+
+@functools.cache
+def _executor() -> futures.ThreadPoolExecutor:
+    """The shared thread pool running the guarded backend calls."""
+    return futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="backend")
+
+
+class CircuitBreaker:
+    """
+    The consecutive failures circuit breaker.
+
+    The breaker opens after `threshold` consecutive failures and rejects all
+    calls for `reset_timeout` seconds. Then it lets a single trial call through
+    (half-open state): a success closes the breaker, a failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        name: str,
+        threshold: int,
+        reset_timeout: float,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        """The current breaker state."""
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            if self._clock() - self._opened_at < self._reset_timeout:
+                return self.OPEN
+            return self.HALF_OPEN
+
+    def allow(self) -> None:
+        """Check whether a call may proceed.
+
+        :raises :class:`CircuitOpen`
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            elapsed = self._clock() - self._opened_at
+            if elapsed < self._reset_timeout or self._trial:
+                raise CircuitOpen(
+                    f"The {self.name} backend circuit breaker is open.",
+                    retry_after=max(self._reset_timeout - elapsed, 1.0),
+                )
+            self._trial = True
+
+    def record_success(self) -> None:
+        """Record a successful call."""
+        with self._lock:
+            if self._opened_at is not None:
+                LOG.info("Closed the circuit breaker.", backend=self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        """Record a failed call."""
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and self._failures >= self._threshold):
+                LOG.warning(
+                    "Opened the circuit breaker.", backend=self.name, failures=self._failures
+                )
+                self._opened_at = self._clock()
+            self._trial = False
+
+
+class LatencyTracker:
+    """The sliding window of the successful calls latencies."""
+
+    def __init__(self, size: int = 512) -> None:
+        self._samples: collections.deque[float] = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        """Record the latency sample."""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        """Compute the `q` latency quantile (nearest-rank) of the window."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+class Guard:
+    """
+    Applies the resilience :class:`Policy` to the calls against a single backend.
+
+    The latencies are tracked per size bucket (powers of 4 bytes), as a large
+    read is always slower than the usual small one and must not be hedged by it.
+
+    :param failures: The exception types considered as transient backend failures, which
+        are retried. Any other exception is counted by the breaker, but not retried.
+    :param ignore: The failure subtypes which are the regular results of a call
+        (e.g. "not found"). They are neither retried nor counted by the breaker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        policy: Policy,
+        failures: tuple[type[Exception], ...],
+        ignore: tuple[type[Exception], ...] = (),
+    ) -> None:
+        self.name = name
+        self.policy = policy
+        self.breaker = CircuitBreaker(name, policy.breaker_threshold, policy.breaker_reset)
+        self._latencies = [LatencyTracker() for _ in range(32)]
+        self._retryable: tuple[type[Exception], ...] = (*failures, DeadlineExceeded)
+        self._ignore = ignore
+
+    def call(
+        self,
+        fn: typing.Callable[..., T],
+        *args: object,
+        idempotent: bool = False,
+        hedge: bool = False,
+        size: int | None = None,
+    ) -> T:
+        """Call `fn` with the given `args` according to the policy.
+
+        :param idempotent: Whether the call may be retried.
+        :param hedge: Whether the call may be duplicated when it is slow.
+        :param size: The expected size in bytes of the data read by the call. The call is
+            hedged by the latencies of the calls of a similar size, and never when unknown.
+
+        :raises :class:`CircuitOpen`
+        :raises :class:`DeadlineExceeded`
+        """
+        self.breaker.allow()
+        deadline = time.monotonic() + self.policy.timeout
+        attempts = self.policy.retries + 1 if idempotent else 1
+        latency = self.latency(size) if hedge and size is not None else None
+
+        for attempt in range(attempts):
+            try:
+                result = self._attempt(fn, args, deadline, latency)
+            except self._ignore:
+                self.breaker.record_success()
+                raise
+            except self._retryable as err:
+                self.breaker.record_failure()
+                remaining = deadline - time.monotonic()
+                if isinstance(err, DeadlineExceeded) or attempt + 1 >= attempts:
+                    raise
+                delay = backoff_delay(attempt, self.policy.backoff_base, self.policy.backoff_cap)
+                if delay >= remaining:
+                    raise
+                LOG.warning(
+                    "Retrying the backend call. %s",
+                    str(err),
+                    backend=self.name,
+                    attempt=attempt + 1,
+                    delay_ms=round(delay * 1000),
+                )
+                time.sleep(delay)
+                self.breaker.allow()
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+        raise AssertionError("unreachable")
+
+    def latency(self, size: int) -> LatencyTracker:
+        """The latencies of the calls reading about `size` bytes."""
+        return self._latencies[min(max(size, 0).bit_length() // 2, len(self._latencies) - 1)]
+
+    def _attempt(
+        self,
+        fn: typing.Callable[..., T],
+        args: tuple[typing.Any, ...],
+        deadline: float,
+        latency: LatencyTracker | None,
+    ) -> T:
+        """Run a single attempt within the deadline, hedged by the `latency` if any."""
+        started = time.monotonic()
+        pending = {_executor().submit(fn, *args)}
+
+        hedge_after = self._hedge_after(latency) if latency is not None else None
+        if hedge_after is not None and hedge_after < deadline - started:
+            done, _ = futures.wait(pending, timeout=hedge_after)
+            if not done:
+                LOG.debug("Sending hedged backend call.", backend=self.name)
+                pending.add(_executor().submit(fn, *args))
+
+        error: BaseException | None = None
+        while pending:
+            done, pending = futures.wait(
+                pending,
+                timeout=max(deadline - time.monotonic(), 0),
+                return_when=futures.FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for future in done:
+                if (error := future.exception()) is None:
+                    if latency is not None:
+                        latency.add(time.monotonic() - started)
+                    return future.result()
+                if isinstance(error, self._ignore):
+                    raise error
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded(
+            f"The {self.name} backend call exceeded the {self.policy.timeout}s deadline.",
+            retry_after=1.0,
+        )
+
+    def _hedge_after(self, latency: LatencyTracker) -> float | None:
+        """The delay after which a hedged call is sent, if hedging is active."""
+        if not self.policy.hedge_quantile or len(latency) < self.policy.hedge_min_samples:
+            return None
+        return latency.quantile(self.policy.hedge_quantile)
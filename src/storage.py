@@ -2,21 +2,51 @@
 The remote storage backend for the HTTP state server.
 """
 
+import collections
+import functools
+import hashlib
 import io
+import os
+import threading
+from collections.abc import Callable
+from concurrent import futures
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+from typing import NamedTuple
 from typing import Protocol
+from typing import TypeVar
 
+import certifi
 import lazy_object_proxy
 import minio
 import minio.error
+import orjson
+import urllib3
+import urllib3.exceptions
 
+from src import cache
+from src import chunking
 from src import errors
 from src import log
+from src import resilience
 from src.config import config
 
-__all__ = ["default", "MinioStorageBackend", "Error", "NotFound"]
+__all__ = [
+    "default",
+    "MinioStorageBackend",
+    "ResilientStorageBackend",
+    "ChunkedStorageBackend",
+    "Error",
+    "NotFound",
+    "Unavailable",
+    "ObjectInfo",
+]
 
 LOG = log.get_logger(__name__)
 
+T = TypeVar("T")
+
 
 class Error(errors.Error):
     """The storage backend error."""
@@ -26,6 +56,25 @@ class NotFound(Error):
     """Raised when requested object ID not found."""
 
 
+class Unavailable(Error):
+    """Raised when the backend call timed out or the backend is failing fast."""
+
+    def __init__(self, msg: str, retry_after: float = 1.0) -> None:
+        """
+        :param retry_after: The number of seconds after which the call may succeed.
+        """
+        self.retry_after = retry_after
+        super().__init__(msg)
+
+
+class ObjectInfo(NamedTuple):
+    """The listed storage object."""
+
+    key: str
+    size: int
+    modified: datetime | None
+
+
 class StorageBackend(Protocol):
     """Protocol for storage backends."""
 
@@ -35,6 +84,10 @@ class StorageBackend(Protocol):
         """Fetch data for the given `key`."""
         ...
 
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        """Fetch `length` bytes of data for the given `key` starting at `offset`."""
+        ...
+
     def create(self, key: str, data: bytes) -> None:
         """Save `data` to the given `key`."""
         ...
@@ -43,6 +96,14 @@ class StorageBackend(Protocol):
         """Delete data by `key`."""
         ...
 
+    def exists(self, key: str) -> bool:
+        """Check whether the data for the given `key` exists."""
+        ...
+
+    def list_objects(self, prefix: str = "") -> list[ObjectInfo]:
+        """List the objects with keys starting with `prefix`."""
+        ...
+
 
 class MinioStorageBackend:
     """
@@ -54,10 +115,20 @@ class MinioStorageBackend:
     name = "MinIO"
 
     def __init__(self) -> None:
+        # Bound the socket timeouts by the operation deadline and disable the client
+        # retries, the :class:`ResilientStorageBackend` retries idempotent calls itself.
+        timeout = config.backend_timeout
         self._client = minio.Minio(
             config.minio_host,
             access_key=config.minio_access_key,
             secret_key=config.minio_secret_key,
+            http_client=urllib3.PoolManager(
+                timeout=urllib3.Timeout(connect=timeout, read=timeout),
+                maxsize=32,
+                cert_reqs="CERT_REQUIRED",
+                ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+                retries=urllib3.Retry(total=0, redirect=3),
+            ),
         )
         self._bucket_name = config.minio_bucket
         super().__init__()
@@ -66,12 +137,15 @@ class MinioStorageBackend:
         """Check if the bucket exists in the MinIO storage."""
         try:
             return self._client.bucket_exists(self._bucket_name)
-        except minio.error.MinioException as err:
+        except (minio.error.MinioException, urllib3.exceptions.HTTPError) as err:
             raise Error(str(err))
 
     def _create_bucket(self) -> None:
         """Create the bucket in the MinIO storage."""
-        self._client.make_bucket(self._bucket_name)
+        try:
+            self._client.make_bucket(self._bucket_name)
+        except (minio.error.MinioException, urllib3.exceptions.HTTPError) as err:
+            raise Error(str(err))
         LOG.info("Created MinIO bucket.", bucket_name=self._bucket_name)
 
     def get(self, key: str) -> bytes:
@@ -82,8 +156,22 @@ class MinioStorageBackend:
         try:
             return self._client.get_object(self._bucket_name, key).read()
         except minio.error.S3Error as err:
-            raise NotFound(str(err))
-        except minio.error.MinioException as err:
+            raise NotFound(str(err)) if _is_not_found(err) else Error(str(err))
+        except (minio.error.MinioException, urllib3.exceptions.HTTPError) as err:
+            raise Error(str(err))
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        """Get a byte range of an object in a MinIO bucket."""
+        if not self._exists_bucket():
+            raise NotFound(f"The {key} object not found.")
+
+        try:
+            return self._client.get_object(
+                self._bucket_name, key, offset=offset, length=length
+            ).read()
+        except minio.error.S3Error as err:
+            raise NotFound(str(err)) if _is_not_found(err) else Error(str(err))
+        except (minio.error.MinioException, urllib3.exceptions.HTTPError) as err:
             raise Error(str(err))
 
     def create(self, key: str, data: bytes) -> None:
@@ -95,7 +183,7 @@ class MinioStorageBackend:
             self._client.put_object(
                 self._bucket_name, key, io.BytesIO(data), length=len(data), metadata={"Owner": ""}
             )
-        except minio.error.MinioException as err:
+        except (minio.error.MinioException, urllib3.exceptions.HTTPError) as err:
             raise Error(str(err))
 
     def delete(self, key: str) -> None:
@@ -106,18 +194,338 @@ class MinioStorageBackend:
         try:
             self._client.remove_object(self._bucket_name, key)
         except minio.error.S3Error as err:
-            raise NotFound(str(err))
-        except minio.error.MinioException as err:
+            raise NotFound(str(err)) if _is_not_found(err) else Error(str(err))
+        except (minio.error.MinioException, urllib3.exceptions.HTTPError) as err:
+            raise Error(str(err))
+
+    def exists(self, key: str) -> bool:
+        """Check whether an object exists in the MinIO storage."""
+        if not self._exists_bucket():
+            return False
+
+        try:
+            self._client.stat_object(self._bucket_name, key)
+        except minio.error.S3Error as err:
+            if _is_not_found(err):
+                return False
+            raise Error(str(err))
+        except (minio.error.MinioException, urllib3.exceptions.HTTPError) as err:
+            raise Error(str(err))
+        return True
+
+    def list_objects(self, prefix: str = "") -> list[ObjectInfo]:
+        """List the objects with keys starting with `prefix` in the MinIO storage."""
+        if not self._exists_bucket():
+            return []
+
+        try:
+            return [
+                ObjectInfo(obj.object_name, obj.size or 0, obj.last_modified)
+                for obj in self._client.list_objects(
+                    self._bucket_name, prefix=prefix or None, recursive=True
+                )
+                if obj.object_name is not None
+            ]
+        except (minio.error.MinioException, urllib3.exceptions.HTTPError) as err:
             raise Error(str(err))
 
 
+def _is_not_found(err: minio.error.S3Error) -> bool:
+    """Check whether the S3 error means a missing object or bucket."""
+    return err.code in ("NoSuchKey", "NoSuchBucket", "ResourceNotFound")
+
+
+class ResilientStorageBackend:
+    """
+    Storage Backend wrapper applying the :mod:`src.resilience` policy to another backend.
+
+    All the storage operations are idempotent, so they are retried on failures.
+    Reads are also hedged when they are slower than the usual latency of the
+    reads of a similar size, by the object sizes seen by the previous calls.
+    """
+
+    KNOWN_SIZES_LIMIT = 100_000
+
+    def __init__(self, backend: StorageBackend, policy: resilience.Policy) -> None:
+        self.name = backend.name
+        self._backend = backend
+        self._guard = resilience.Guard(backend.name, policy, failures=(Error,), ignore=(NotFound,))
+        self._sizes: collections.OrderedDict[str, int] = collections.OrderedDict()
+        self._sizes_lock = threading.Lock()
+
+    def get(self, key: str) -> bytes:
+        """Fetch data for the given `key`."""
+        with self._sizes_lock:
+            size = self._sizes.get(key)
+        data = self._call(self._backend.get, key, hedge=True, size=size)
+        self._remember(key, len(data))
+        return data
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        """Fetch `length` bytes of data for the given `key` starting at `offset`."""
+        return self._call(self._backend.get_range, key, offset, length, hedge=True, size=length)
+
+    def create(self, key: str, data: bytes) -> None:
+        """Save `data` to the given `key`."""
+        self._call(self._backend.create, key, data)
+        self._remember(key, len(data))
+
+    def delete(self, key: str) -> None:
+        """Delete data by `key`."""
+        with self._sizes_lock:
+            self._sizes.pop(key, None)
+        self._call(self._backend.delete, key)
+
+    def exists(self, key: str) -> bool:
+        """Check whether the data for the given `key` exists."""
+        return self._call(self._backend.exists, key, hedge=True, size=0)
+
+    def list_objects(self, prefix: str = "") -> list[ObjectInfo]:
+        """List the objects with keys starting with `prefix`."""
+        return self._call(self._backend.list_objects, prefix)
+
+    def _call(
+        self, fn: Callable[..., T], *args: object, hedge: bool = False, size: int | None = None
+    ) -> T:
+        try:
+            return self._guard.call(fn, *args, idempotent=True, hedge=hedge, size=size)
+        except resilience.Error as err:
+            raise Unavailable(str(err), retry_after=err.retry_after) from err
+
+    def _remember(self, key: str, size: int) -> None:
+        """Remember the object size, the next reads are hedged by its latencies."""
+        with self._sizes_lock:
+            self._sizes[key] = size
+            self._sizes.move_to_end(key)
+            while len(self._sizes) > self.KNOWN_SIZES_LIMIT:
+                self._sizes.popitem(last=False)
+
+
+class ChunkedStorageBackend:
+    """
+    Storage Backend wrapper storing the data as deduplicated content-defined chunks.
+
+    The data is split by :func:`src.chunking.split`, every chunk is stored once
+    under its SHA-256 digest in the `.chunks/` prefix, and the `key` holds a small
+    manifest listing the chunks. Only the chunks the store does not have yet are
+    uploaded, so the similar states and the successive serials of a state share
+    most of their chunks. The data smaller than a chunk is stored as is.
+
+    The chunks are not deleted with the manifests, as they may be referenced by
+    other manifests, the unreferenced ones are deleted by :meth:`collect_garbage`
+    once they are older than `gc_grace` seconds. A reused chunk older than half
+    of the grace period is uploaded again, which refreshes its modification time,
+    so the chunks referenced by the manifests being written are never old enough
+    to be collected. The chunks checked within a quarter of the grace period are
+    not checked again by the same process.
+
+    :param gc_grace: The number of seconds a chunk is kept after its last write.
+    :param clock: The current time, e.g. for tests.
+    """
+
+    MANIFEST_MAGIC = b"tofu-chunks/1\n"
+    KNOWN_CHUNKS_LIMIT = 100_000
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        avg_size: int = chunking.DEFAULT_AVG_SIZE,
+        gc_grace: float = 3600.0,
+        clock: Callable[[], datetime] = lambda: datetime.now(UTC),
+    ) -> None:
+        self.name = backend.name
+        self._backend = backend
+        self._avg_size = avg_size
+        self._grace = timedelta(seconds=gc_grace)
+        self._clock = clock
+        self._known: cache.TTLCache[str, bool] = cache.TTLCache(
+            self.KNOWN_CHUNKS_LIMIT, gc_grace / 4, clock=lambda: clock().timestamp()
+        )
+
+    def get(self, key: str) -> bytes:
+        """Fetch data for the given `key`, reassembled from its chunks."""
+        data = self._backend.get(key)
+        if not data.startswith(self.MANIFEST_MAGIC):
+            return data
+
+        manifest = orjson.loads(data[len(self.MANIFEST_MAGIC) :])
+        chunks = _executor().map(self._get_chunk, [digest for digest, _ in manifest["chunks"]])
+        data = b"".join(chunks)
+        if hashlib.sha256(data).hexdigest() != manifest["sha256"]:
+            raise Error(f"The {key} object chunks are corrupted.")
+        return data
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        """Fetch a byte range of data for the given `key`, reading only the covering chunks."""
+        data = self._backend.get(key)
+        if not data.startswith(self.MANIFEST_MAGIC):
+            return data[offset : offset + length]
+
+        manifest = orjson.loads(data[len(self.MANIFEST_MAGIC) :])
+        digests: list[str] = []
+        start = position = 0
+        for digest, size in manifest["chunks"]:
+            if position + size > offset and position < offset + length:
+                if not digests:
+                    start = position
+                digests.append(digest)
+            position += size
+        data = b"".join(_executor().map(self._get_chunk, digests))
+        return data[offset - start : offset - start + length]
+
+    def create(self, key: str, data: bytes) -> None:
+        """Save `data` to the given `key`, uploading only the missing and old chunks."""
+        if len(data) < self._avg_size and not data.startswith(self.MANIFEST_MAGIC):
+            self._backend.create(key, data)
+            return
+
+        digests: list[str] = []
+        chunks: dict[str, memoryview] = {}
+        for chunk in chunking.split(data, self._avg_size):
+            digests.append(digest := hashlib.sha256(chunk).hexdigest())
+            chunks[digest] = chunk
+
+        def upload(digest: str) -> None:
+            self._backend.create(_chunk_key(digest), bytes(chunks[digest]))
+
+        unknown = [digest for digest in chunks if self._known.get(digest) is None]
+        refresh_before = self._clock() - self._grace / 2
+        stats = _executor().map(self._stat, unknown)
+        stale = [
+            digest
+            for digest, info in zip(unknown, stats, strict=True)
+            if info is None or info.modified is None or info.modified < refresh_before
+        ]
+        list(_executor().map(upload, stale))
+
+        manifest = {
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "chunks": [[digest, len(chunks[digest])] for digest in digests],
+        }
+        self._backend.create(key, self.MANIFEST_MAGIC + orjson.dumps(manifest))
+        # A collection which has seen the old modification time of a refreshed chunk
+        # may have swept it meanwhile, the manifest is written, so it is kept from now on.
+        exists = _executor().map(self._backend.exists, map(_chunk_key, stale))
+        list(_executor().map(upload, [d for d, e in zip(stale, exists, strict=True) if not e]))
+        for digest in unknown:
+            self._known.set(digest, True)
+        LOG.debug("Stored chunked object.", key=key, chunks=len(chunks), uploaded=len(stale))
+
+    def delete(self, key: str) -> None:
+        """Delete the manifest of the given `key`."""
+        self._backend.delete(key)
+
+    def exists(self, key: str) -> bool:
+        """Check whether the data for the given `key` exists."""
+        return self._backend.exists(key)
+
+    def list_objects(self, prefix: str = "") -> list[ObjectInfo]:
+        """List the objects with keys starting with `prefix`, except the chunks."""
+        return [obj for obj in self._backend.list_objects(prefix) if not _is_chunk(obj.key)]
+
+    def collect_garbage(self) -> int:
+        """Delete the chunks not referenced by any manifest (mark and sweep).
+
+        The chunks written within the grace period are kept, as they may be used by
+        a manifest which is not written yet. The manifests written during the
+        collection are checked again before the sweep, and the modification time
+        of every chunk is checked again right before it is deleted.
+
+        :return: The number of the deleted chunks.
+        """
+        cutoff = self._clock() - self._grace
+        objects = self._backend.list_objects()
+        referenced = self._referenced([obj.key for obj in objects if not _is_chunk(obj.key)])
+        garbage = {
+            obj.key.rsplit("/", 1)[-1]
+            for obj in objects
+            if _is_chunk(obj.key) and obj.modified is not None and obj.modified < cutoff
+        }
+        if garbage := garbage - referenced:
+            recent = [
+                obj.key
+                for obj in self._backend.list_objects()
+                if not _is_chunk(obj.key) and (obj.modified is None or obj.modified >= cutoff)
+            ]
+            garbage -= self._referenced(recent)
+
+        def delete(digest: str) -> bool:
+            # The chunk may have been reused and refreshed since it was listed.
+            info = self._stat(digest)
+            if (
+                info is None
+                or info.modified is None
+                or info.modified >= self._clock() - self._grace
+            ):
+                return False
+            self._known.pop(digest)
+            try:
+                self._backend.delete(_chunk_key(digest))
+            except NotFound:
+                return False
+            return True
+
+        deleted = sum(_executor().map(delete, garbage))
+        LOG.info("Collected unreferenced chunks.", chunks=len(objects), deleted=deleted)
+        return deleted
+
+    def _referenced(self, keys: list[str]) -> set[str]:
+        """The digests of the chunks referenced by the manifests among `keys`."""
+
+        def digests(key: str) -> list[str]:
+            try:
+                if self._backend.get_range(key, 0, len(self.MANIFEST_MAGIC)) != self.MANIFEST_MAGIC:
+                    return []
+                data = self._backend.get(key)
+            except NotFound:
+                return []
+            manifest = orjson.loads(data[len(self.MANIFEST_MAGIC) :])
+            return [digest for digest, _ in manifest["chunks"]]
+
+        return {digest for found in _executor().map(digests, keys) for digest in found}
+
+    def _get_chunk(self, digest: str) -> bytes:
+        try:
+            return self._backend.get(_chunk_key(digest))
+        except NotFound as err:
+            self._known.pop(digest)
+            raise Error(f"The {digest} chunk is missing. {err}")
+
+    def _stat(self, digest: str) -> ObjectInfo | None:
+        """The listing of the stored chunk, with its modification time, if it exists."""
+        key = _chunk_key(digest)
+        return next((obj for obj in self._backend.list_objects(key) if obj.key == key), None)
+
+
+def _chunk_key(digest: str) -> str:
+    """Build the storage key of a chunk."""
+    return f".chunks/{digest[:2]}/{digest}"
+
+
+def _is_chunk(key: str) -> bool:
+    return key.startswith(".chunks/")
+
+
+@functools.cache
+def _executor() -> futures.ThreadPoolExecutor:
+    """The thread pool transferring the chunks concurrently."""
+    return futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="chunks")
+
+
 def create_default_backend() -> StorageBackend:
     """Create the default storage backend."""
+    backend: StorageBackend
     match b := config.storage_backend:
         case "minio":
-            return MinioStorageBackend()
+            backend = ResilientStorageBackend(MinioStorageBackend(), resilience.default_policy())
         case _:
             raise ValueError(f"Unsupported storage backend: {b}")
+    if config.storage_chunking:
+        backend = ChunkedStorageBackend(
+            backend, config.storage_chunk_size, config.storage_chunks_gc_grace
+        )
+    return backend
 
 
 default: "StorageBackend" = lazy_object_proxy.Proxy(create_default_backend)
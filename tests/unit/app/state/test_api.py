@@ -0,0 +1,211 @@
+import asyncio
+import base64
+import time
+import typing
+
+import orjson
+import pytest
+
+from src import admission
+from src import auth
+from src.app.state import api
+from src.app.state import catalog
+from src.cmd import app
+
+from .test_delta import make_state
+
+USERS = {"admin": ("",), "team-a": ("team-a/", "shared/")}
+
+
+async def request(  # noqa: PLR0913
+    user: str,
+    method: str,
+    path: str,
+    body: bytes = b"",
+    query: bytes = b"",
+    *,
+    project: bool = True,
+) -> tuple[int, typing.Any]:
+    """Send the request of the user to the ASGI app, return the status and the decoded body.
+
+    :param project: Wait for the state projections of the writes.
+    """
+    token = base64.b64encode(f"{user}:secret".encode()).decode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query,
+        "root_path": "",
+        "headers": [
+            (b"authorization", f"Basic {token}".encode()),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    sent = False
+    response: dict[str, typing.Any] = {"body": b""}
+
+    async def receive() -> dict[str, typing.Any]:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()
+        raise AssertionError("unreachable")
+
+    async def send(message: dict[str, typing.Any]) -> None:
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    while project and api._projections:  # noqa: SLF001
+        await asyncio.sleep(0.01)
+    return response["status"], orjson.loads(response["body"] or b"null")
+
+
+@pytest.fixture
+def users(fake_storage, wait_catalog, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Rebuild the missing catalog before the states are written.
+    catalog.default.size("")
+    wait_catalog()
+    password_hash = auth.hash_password("secret", n=2**4)
+    authenticator = auth.Authenticator(
+        {name: (password_hash, prefixes) for name, prefixes in USERS.items()}, 10, 60
+    )
+    monkeypatch.setattr(auth, "default", authenticator)
+    monkeypatch.setattr(admission, "default", admission.create_default_limiter())
+
+
+async def create_states() -> None:
+    body = orjson.dumps(
+        make_state(1, count=1) | {"terraform_version": "1.8.0", "check_results": None}
+    )
+    for state_id in ("team-a/network", "team-b/network", "shared/dns"):
+        assert await request("admin", "POST", f"/state/{state_id}", body) == (200, None)
+
+
+@pytest.mark.usefixtures("users")
+def test_authorize() -> None:
+    async def main() -> None:
+        await create_states()
+        for path in (
+            "/state/team-a/network",
+            "/catalog/team-a/network",
+            "/outputs/team-a/network",
+            "/resources/team-a/network",
+            "/versions/team-a/network",
+            "/version/1/team-a/network",
+        ):
+            assert (await request("team-a", "GET", path))[0] == 200, path
+            assert (await request("team-a", "GET", path.replace("team-a", "team-b")))[0] == 403
+
+        assert (await request("team-a", "POST", "/state/team-b/network", b"{}"))[0] == 403
+        assert (await request("team-a", "DELETE", "/state/team-b/network"))[0] == 403
+        assert (await request("team-a", "POST", "/admin/catalog/rebuild"))[0] == 403
+        assert (await request("team-a", "GET", "/state/team-b/network"))[0] == 403
+        query = b"state_id=team-a/network&state_id=team-b/network"
+        assert (await request("team-a", "GET", "/outputs", query=query))[0] == 403
+        assert (await request("admin", "GET", "/state/team-b/network"))[0] == 200
+
+    asyncio.run(main())
+
+
+@pytest.mark.usefixtures("users")
+def test_list_states() -> None:
+    async def main() -> None:
+        await create_states()
+        status, body = await request("team-a", "GET", "/catalog")
+        assert status == 200
+        assert [s["id"] for s in body["states"]] == ["shared/dns", "team-a/network"]
+
+        status, body = await request("team-a", "GET", "/catalog", query=b"prefix=team-b/")
+        assert status == 200
+        assert body["states"] == []
+
+        status, body = await request("admin", "GET", "/catalog")
+        assert [s["id"] for s in body["states"]] == [
+            "shared/dns",
+            "team-a/network",
+            "team-b/network",
+        ]
+
+    asyncio.run(main())
+
+
+@pytest.mark.usefixtures("users")
+def test_get_state_admitted(monkeypatch: pytest.MonkeyPatch) -> None:
+    in_flight = []
+    state_response = api._state_response  # noqa: SLF001
+
+    def spy(state: typing.Any) -> typing.Any:
+        in_flight.append(admission.default.in_flight)
+        return state_response(state)
+
+    monkeypatch.setattr(api, "_state_response", spy)
+
+    async def main() -> None:
+        await create_states()
+        status, body = await request("team-a", "GET", "/state/team-a/network")
+        assert status == 200
+        assert body["serial"] == 1
+        assert (await request("team-a", "GET", "/version/1/team-a/network"))[0] == 200
+        assert admission.default.in_flight == 0
+
+    asyncio.run(main())
+    assert len(in_flight) == 2
+    assert all(in_flight)
+
+
+@pytest.mark.usefixtures("users")
+def test_delete_projected(fake_storage, monkeypatch: pytest.MonkeyPatch) -> None:
+    save_index = api._save_index  # noqa: SLF001
+
+    def slow_save_index(*args: typing.Any) -> None:
+        time.sleep(0.1)
+        save_index(*args)
+
+    monkeypatch.setattr(api, "_save_index", slow_save_index)
+    body = orjson.dumps(
+        make_state(1, count=1) | {"terraform_version": "1.8.0", "check_results": None}
+    )
+
+    async def main() -> None:
+        assert await request("admin", "POST", "/state/a", body, project=False) == (200, None)
+        assert api._projections  # noqa: SLF001
+        assert await request("admin", "DELETE", "/state/a") == (200, None)
+        # The pending projections are neither left behind nor re-added to the catalog.
+        assert not [key for key in fake_storage.objects if not key.startswith(catalog.PREFIX)]
+        assert catalog.default.get("a") is None
+
+    asyncio.run(main())
+
+
+@pytest.mark.usefixtures("users")
+def test_reserved_state_ids(fake_storage) -> None:
+    async def main() -> None:
+        await create_states()
+        objects = dict(fake_storage.objects)
+        for state_id in (
+            "team-a/network.outputs",
+            "team-a/network.index",
+            "team-a/network.lock",
+            "team-a/network.versions/index.json",
+            ".catalog/ab",
+            ".chunks/ab/abcd",
+        ):
+            assert (await request("admin", "POST", f"/state/{state_id}", b"{}"))[0] == 400
+            assert (await request("admin", "DELETE", f"/state/{state_id}"))[0] == 400
+            assert (await request("admin", "GET", f"/state/{state_id}"))[0] == 400
+            assert (await request("admin", "GET", f"/outputs/{state_id}"))[0] == 400
+        # The derived objects of the states are untouched.
+        assert fake_storage.objects == objects
+
+    asyncio.run(main())
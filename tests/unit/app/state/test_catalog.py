@@ -0,0 +1,137 @@
+import threading
+
+import orjson
+import pytest
+
+from src.app.state import catalog
+
+from .test_delta import make_state
+
+
+def write(fake_storage, state_id: str, serial: int) -> bytes:
+    body = orjson.dumps(make_state(serial, count=1))
+    fake_storage.objects[state_id] = body
+    return body
+
+
+def test_is_state() -> None:
+    assert catalog.is_state("project/network")
+    for key in (
+        "project/network.lock",
+        "project/network.outputs",
+        "project/network.index",
+        "project/network.versions/index.json",
+        ".catalog/ab",
+        ".chunks/ab/abcd",
+    ):
+        assert not catalog.is_state(key)
+
+
+def load(c: catalog.Catalog, wait_catalog) -> catalog.Catalog:
+    """Load the catalog, rebuilding the missing one."""
+    c.size("")
+    wait_catalog()
+    return c
+
+
+def test_update_and_list(fake_storage, wait_catalog) -> None:
+    c = load(catalog.Catalog(), wait_catalog)
+    for i in range(5):
+        body = write(fake_storage, f"prod/app{i}", i)
+        c.put(f"prod/app{i}", body, orjson.loads(body), "digest")
+    c.put("dev/app", write(fake_storage, "dev/app", 1), None, "digest")
+    c.lock("prod/app1", {"id": "lock1", "who": "me"})
+
+    states, next_ = c.list_states("prod/", limit=2)
+    assert [s.id for s in states] == ["prod/app0", "prod/app1"]
+    assert states[1].serial == 1
+    assert states[1].lineage == "abcd"
+    assert states[1].locked_by == "me"
+    states, next_ = c.list_states("prod/", after=next_, limit=2)
+    assert [s.id for s in states] == ["prod/app2", "prod/app3"]
+    states, next_ = c.list_states("prod/", after=next_, limit=2)
+    assert [s.id for s in states] == ["prod/app4"]
+    assert next_ is None
+
+    dev = c.get("dev/app")
+    assert dev is not None
+    assert dev.serial is None
+    assert dev.size == len(fake_storage.objects["dev/app"])
+
+    c.unlock("prod/app1")
+    c.remove("prod/app0")
+    states, _ = c.list_states("prod/")
+    assert [s.id for s in states] == [f"prod/app{i}" for i in range(1, 5)]
+    assert states[0].locked_by is None
+
+    # The catalog is persisted and loaded by another instance.
+    assert catalog.Catalog().list_states() == c.list_states()
+
+
+def test_lock_unwritten(fake_storage, wait_catalog) -> None:
+    c = load(catalog.Catalog(), wait_catalog)
+    c.lock("new", {"id": "lock1", "who": "me"})
+    assert c.get("new") is not None
+    c.unlock("new")
+    assert c.get("new") is None
+
+
+def test_rebuild(fake_storage, wait_catalog) -> None:
+    write(fake_storage, "a", 1)
+    write(fake_storage, "b/c", 2)
+    fake_storage.objects["b/c.lock"] = orjson.dumps({"id": "lock1", "who": "me"})
+    fake_storage.objects["b/c.outputs"] = b"{}"
+    fake_storage.objects["b/c.versions/index.json"] = b"{}"
+
+    # The missing catalog is rebuilt in background on the first use.
+    c = load(catalog.Catalog(), wait_catalog)
+    states, _ = c.list_states()
+    assert [(s.id, s.serial, s.locked_by) for s in states] == [("a", 1, None), ("b/c", 2, "me")]
+    assert any(key.startswith(catalog.PREFIX) for key in fake_storage.objects)
+
+    del fake_storage.objects["a"]
+    assert c.rebuild() == 1
+    assert [s.id for s in catalog.Catalog().list_states()[0]] == ["b/c"]
+
+
+def test_workers(fake_storage, monkeypatch, wait_catalog) -> None:
+    # Two workers updating the same shard keep the updates of each other.
+    first, second = load(catalog.Catalog(), wait_catalog), load(catalog.Catalog(), wait_catalog)
+    ids = [f"s{i}" for i in range(1000) if catalog._shard(f"s{i}") == catalog._shard("s0")][:2]
+    first.put(ids[0], write(fake_storage, ids[0], 1), None, "digest")
+    second.put(ids[1], write(fake_storage, ids[1], 1), None, "digest")
+    assert [s.id for s in catalog.Catalog().list_states()[0]] == ids
+
+    # The workers see the updates of each other after the refresh interval.
+    second.remove(ids[0])
+    assert first.get(ids[0]) is not None
+    monkeypatch.setattr(catalog.config, "catalog_refresh_interval", 0)
+    load(first, wait_catalog)
+    monkeypatch.setattr(catalog.config, "catalog_refresh_interval", 30)
+    assert first.get(ids[0]) is None
+    assert [s.id for s in first.list_states()[0]] == ids[1:]
+
+
+def test_load_in_background(fake_storage, monkeypatch, wait_catalog) -> None:
+    body = write(fake_storage, "a", 1)
+    listed, rebuilt = threading.Event(), threading.Event()
+    list_objects = fake_storage.list_objects
+
+    def wait_list_objects(prefix: str = "") -> list:
+        (listed if prefix else rebuilt).wait(10)
+        return list_objects(prefix)
+
+    monkeypatch.setattr(fake_storage, "list_objects", wait_list_objects)
+    c = catalog.Catalog()
+    # The state size is unknown until the catalog is loaded, the callers never wait for it.
+    assert c.size("a") is None
+    c.put("b", write(fake_storage, "b", 1), None, "digest")
+    listed.set()
+    # The missing catalog is listed only once it is rebuilt.
+    with pytest.raises(catalog.Rebuilding):
+        c.list_states()
+    assert c.size("a") is None
+    rebuilt.set()
+    wait_catalog()
+    assert c.size("a") == len(body)
+    assert [s.id for s in c.list_states()[0]] == ["a", "b"]
@@ -0,0 +1,67 @@
+import copy
+
+import orjson
+import pytest
+
+from src.app.state import delta
+
+
+def make_state(serial: int, count: int = 100) -> dict:
+    return {
+        "version": 4,
+        "serial": serial,
+        "lineage": "abcd",
+        "outputs": {"id": {"value": str(serial), "type": "string"}},
+        "resources": [
+            {
+                "mode": "managed",
+                "type": "null_resource",
+                "name": "dummy",
+                "instances": [
+                    {
+                        "index_key": i,
+                        "attributes": {
+                            "id": str(i),
+                            "triggers": {"run": str(serial), "long_string": "Lorem ipsum " * 8},
+                        },
+                    }
+                    for i in range(count)
+                ],
+            }
+        ],
+    }
+
+
+@pytest.mark.parametrize(
+    ("old", "new"),
+    [
+        (1, 2),
+        ({"a": 1, "b": [1, 2]}, {"a": 1, "c": None}),
+        ([1, 2, 3, 4], [0, 1, 3, 4, 5]),
+        ([{"a": 1}, {"b": 2}], [{"a": 2}, {"b": 2}, {"c": 3}]),
+        ([], [{"a": 1}]),
+        ({"a": {"b": {"c": [1]}}}, {"a": {"b": {"c": [2]}}}),
+        ({"a": 1}, {"a": True}),
+        (0, False),
+        ([1, 0.0], [True, 0]),
+    ],
+)
+def test_diff_patch(old: object, new: object) -> None:
+    original = copy.deepcopy(old)
+    result = delta.patch(old, delta.diff(old, new))
+    assert orjson.dumps(result) == orjson.dumps(new)
+    assert old == original
+
+
+def test_diff_equal() -> None:
+    assert delta.diff(make_state(1), make_state(1)) is None
+
+
+def test_diff_state_is_compact() -> None:
+    old, new = make_state(1), make_state(2)
+    new["resources"][0]["instances"].pop(10)
+
+    patch = delta.diff(old, new)
+
+    assert delta.patch(old, orjson.loads(orjson.dumps(patch))) == new
+    assert len(orjson.dumps(patch)) < len(orjson.dumps(new)) // 2
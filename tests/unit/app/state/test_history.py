@@ -0,0 +1,77 @@
+import concurrent.futures
+import hashlib
+
+import orjson
+import pytest
+
+from src.app.state import history
+from src.config import config
+
+from .test_delta import make_state
+
+
+def write(state_id: str, state: dict) -> None:
+    body = orjson.dumps(state)
+    history.record(state_id, body, state, hashlib.sha256(body).hexdigest())
+
+
+def test_record_and_get(fake_storage, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, "history_snapshot_interval", 3)
+    for serial in range(1, 8):
+        write("my/state", make_state(serial))
+
+    versions = history.list_versions("my/state")
+    assert [v.serial for v in versions] == list(range(1, 8))
+    assert [v.kind for v in versions] == [
+        "full",
+        "delta",
+        "delta",
+        "delta",
+        "full",
+        "delta",
+        "delta",
+    ]
+    for serial in range(1, 8):
+        assert history.get_version("my/state", serial) == make_state(serial)
+
+    with pytest.raises(history.NotFound):
+        history.get_version("my/state", 8)
+
+
+def test_compact(fake_storage, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, "history_max_versions", 3)
+    for serial in range(1, 6):
+        write("my/state", make_state(serial))
+
+    versions = history.list_versions("my/state")
+    assert [(v.serial, v.kind) for v in versions] == [(3, "full"), (4, "delta"), (5, "delta")]
+    assert history.get_version("my/state", 3) == make_state(3)
+    assert len(fake_storage.objects) == 4
+
+
+def test_rewrite_and_purge(fake_storage) -> None:
+    write("my/state", make_state(1))
+    write("my/state", make_state(2))
+    write("my/state", make_state(2) | {"lineage": "other"})
+
+    versions = history.list_versions("my/state")
+    assert [(v.serial, v.kind, v.lineage) for v in versions] == [
+        (1, "full", "abcd"),
+        (2, "full", "other"),
+    ]
+
+    history.purge("my/state")
+    assert fake_storage.objects == {}
+
+
+def test_record_concurrent(fake_storage) -> None:
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda serial: write("my/state", make_state(serial)), range(1, 17)))
+
+    # Every recorded version is listed in the index, none is orphaned.
+    versions = history.list_versions("my/state")
+    assert sorted(fake_storage.objects) == sorted(
+        [f"my/state.versions/{v.object_name}" for v in versions] + ["my/state.versions/index.json"]
+    )
+    for version in versions:
+        assert history.get_version("my/state", version.serial) == make_state(version.serial)
@@ -0,0 +1,108 @@
+import hashlib
+import json
+
+import orjson
+import pytest
+
+from src.app.state import catalog
+from src.app.state import index
+
+
+def make_state(body_prefix: str = "") -> dict:
+    return {
+        "version": 4,
+        "serial": 1,
+        "lineage": "abcd",
+        "outputs": {"note": {"value": "ünïcode", "type": "string"}},
+        "resources": [
+            {
+                "module": "module.vpc",
+                "mode": "managed",
+                "type": "aws_subnet",
+                "name": "private",
+                "instances": [{"attributes": {"id": f"{body_prefix}{i}"}} for i in range(3)],
+            },
+            {
+                "mode": "data",
+                "type": "aws_ami",
+                "name": "ubuntu",
+                "instances": [{"attributes": {"name": "ubuntu ✓"}}],
+            },
+            {"mode": "managed", "type": "null_resource", "name": "dummy", "instances": []},
+        ],
+    }
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_build(indent: int | None) -> None:
+    state = make_state()
+    body = json.dumps(state, indent=indent, ensure_ascii=False).encode()
+    result = index.build(body)
+
+    assert result["size"] == len(body)
+    assert [index.address(r) for r in result["resources"]] == [
+        "module.vpc.aws_subnet.private",
+        "data.aws_ami.ubuntu",
+        "null_resource.dummy",
+    ]
+    assert [r["instances"] for r in result["resources"]] == [3, 1, 0]
+    for record, resource in zip(result["resources"], state["resources"], strict=True):
+        assert orjson.loads(body[record["start"] : record["end"]]) == resource
+
+
+def test_build_invalid() -> None:
+    with pytest.raises(ValueError):
+        index.build(b"[]")
+    with pytest.raises(ValueError):
+        index.build(b'{"resources": [')
+
+
+def test_query(fake_storage) -> None:
+    state = make_state()
+    fake_storage.objects["my/state"] = orjson.dumps(state, option=orjson.OPT_INDENT_2)
+
+    # The missing index is built on the first query.
+    assert index.query("my/state", type="aws_subnet") == [state["resources"][0]]
+    assert "my/state.index" in fake_storage.objects
+
+    assert index.query("my/state", address="data.aws_ami.ubuntu") == [state["resources"][1]]
+    assert index.query("my/state", mode="managed", module="module.vpc") == [state["resources"][0]]
+    assert index.query("my/state") == state["resources"]
+    assert index.query("my/state", name="unknown") == []
+
+
+def test_query_outdated(fake_storage) -> None:
+    fake_storage.objects["my/state"] = orjson.dumps(make_state())
+    index.save("my/state", index.build(fake_storage.objects["my/state"]))
+
+    # The state is rewritten without updating the index.
+    state = make_state("subnet-")
+    fake_storage.objects["my/state"] = orjson.dumps(state, option=orjson.OPT_INDENT_2)
+
+    assert index.query("my/state", name="ubuntu") == [state["resources"][1]]
+    assert index.query("my/state", name="private") == [state["resources"][0]]
+
+
+def test_delete(fake_storage) -> None:
+    fake_storage.objects["my/state.index"] = b"{}"
+    index.delete("my/state")
+    index.delete("my/state")
+    assert fake_storage.objects == {}
+
+
+def test_query_appended(fake_storage) -> None:
+    state = make_state()
+    body = orjson.dumps(state)
+    fake_storage.objects["my/state"] = body
+    index.save("my/state", index.build(body))
+
+    # A resource is appended, the indexed ones are still in place.
+    state["resources"].append({**state["resources"][0], "name": "public"})
+    body = orjson.dumps(state)
+    fake_storage.objects["my/state"] = body
+    catalog.default.put("my/state", body, state, hashlib.sha256(body).hexdigest())
+
+    assert index.query("my/state", type="aws_subnet") == [
+        state["resources"][0],
+        state["resources"][3],
+    ]
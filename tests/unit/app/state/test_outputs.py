@@ -0,0 +1,46 @@
+import orjson
+import pytest
+
+from src.app.state import outputs
+
+from .test_delta import make_state
+
+
+def test_project() -> None:
+    state = make_state(3)
+    projection = orjson.loads(outputs.project(state))
+
+    assert projection["outputs"] == state["outputs"]
+    assert projection["serial"] == 3
+    assert projection["resources"] == []
+
+
+def test_save_get_delete(fake_storage) -> None:
+    fake_storage.objects["my/state"] = orjson.dumps(make_state(1))
+
+    assert orjson.loads(outputs.get("my/state"))["serial"] == 1
+    assert "my/state.outputs" not in fake_storage.objects
+
+    outputs.save("my/state", make_state(2))
+    assert orjson.loads(outputs.get("my/state"))["serial"] == 2
+
+    outputs.delete("my/state")
+    assert "my/state.outputs" not in fake_storage.objects
+
+
+def test_get_concurrent_save(fake_storage, monkeypatch: pytest.MonkeyPatch) -> None:
+    fake_storage.objects["other/state"] = orjson.dumps(make_state(1))
+    get = fake_storage.get
+
+    def get_and_save(key: str) -> bytes:
+        data = get(key)
+        if key == "other/state":
+            # The state is rewritten while its projection is rebuilt.
+            outputs.save("other/state", make_state(2))
+        return data
+
+    monkeypatch.setattr(fake_storage, "get", get_and_save)
+    assert orjson.loads(outputs.get("other/state"))["serial"] == 1
+    assert orjson.loads(outputs.get("other/state"))["serial"] == 2
+    assert orjson.loads(fake_storage.objects["other/state.outputs"])["serial"] == 2
+    outputs.delete("other/state")
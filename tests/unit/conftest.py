@@ -0,0 +1,69 @@
+from datetime import UTC
+from datetime import datetime
+
+import typing
+
+import pytest
+
+from src import storage
+from src.app.state import catalog
+
+
+class FakeStorageBackend:
+    """The dict based storage backend for unit tests."""
+
+    name = "fake"
+
+    def __init__(self) -> None:
+        self.objects: dict[str, bytes] = {}
+        self.modified: dict[str, datetime] = {}
+        self.clock = lambda: datetime.now(UTC)
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self.objects[key]
+        except KeyError:
+            raise storage.NotFound(f"The {key} object not found.")
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        return self.get(key)[offset : offset + length]
+
+    def create(self, key: str, data: bytes) -> None:
+        self.objects[key] = data
+        self.modified[key] = self.clock()
+
+    def delete(self, key: str) -> None:
+        if self.objects.pop(key, None) is None:
+            raise storage.NotFound(f"The {key} object not found.")
+
+    def exists(self, key: str) -> bool:
+        return key in self.objects
+
+    def list_objects(self, prefix: str = "") -> list[storage.ObjectInfo]:
+        return [
+            storage.ObjectInfo(key, len(data), self.modified.get(key))
+            for key, data in sorted(self.objects.items())
+            if key.startswith(prefix)
+        ]
+
+
+def _wait_catalog() -> None:
+    """Wait for the background catalog loads, and the rebuilds they schedule."""
+    for _ in range(2):
+        catalog._loader().submit(lambda: None).result()  # noqa: SLF001
+
+
+@pytest.fixture
+def wait_catalog() -> typing.Callable[[], None]:
+    """Wait for the background catalog loads."""
+    return _wait_catalog
+
+
+@pytest.fixture
+def fake_storage(monkeypatch: pytest.MonkeyPatch) -> typing.Iterator[FakeStorageBackend]:
+    """Replace the default storage backend with an in-memory one."""
+    backend = FakeStorageBackend()
+    monkeypatch.setattr(storage, "default", backend)
+    monkeypatch.setattr(catalog, "default", catalog.Catalog())
+    yield backend
+    _wait_catalog()
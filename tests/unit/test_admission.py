@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from src import admission
+
+
+def test_budget_queue() -> None:
+    async def main() -> list[str]:
+        limiter = admission.Limiter(budget=100, queue_timeout=1.0, client_limit=0)
+        events = []
+
+        async def request(name: str, nbytes: int, hold: float) -> None:
+            async with limiter.admit(name, nbytes):
+                events.append(f"+{name}")
+                await asyncio.sleep(hold)
+                events.append(f"-{name}")
+
+        await asyncio.gather(
+            request("a", 60, 0.05),
+            request("b", 60, 0.0),
+            # Bigger than the budget, admitted alone.
+            request("c", 1000, 0.0),
+            request("d", 10, 0.0),
+        )
+        assert limiter.in_flight == 0
+        return events
+
+    # The queue is FIFO, so "d" waits for "c" although it would fit earlier.
+    assert asyncio.run(main()) == ["+a", "-a", "+b", "-b", "+c", "-c", "+d", "-d"]
+
+
+def test_overloaded() -> None:
+    async def main() -> None:
+        limiter = admission.Limiter(budget=100, queue_timeout=0.01, client_limit=0)
+        async with limiter.admit("a", 100):
+            with pytest.raises(admission.Overloaded) as err:
+                async with limiter.admit("b", 1):
+                    pass
+            assert err.value.retry_after == limiter.queue_timeout
+            assert len(limiter) == 0
+        async with limiter.admit("b", 100):
+            pass
+
+    asyncio.run(main())
+
+
+def test_cancelled() -> None:
+    async def main() -> None:
+        limiter = admission.Limiter(budget=100, queue_timeout=1.0, client_limit=0)
+        async with limiter.admit("a", 100):
+            task = asyncio.create_task(limiter.acquire(50))
+            await asyncio.sleep(0)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        assert limiter.in_flight == 0
+        assert len(limiter) == 0
+
+    asyncio.run(main())
+
+
+def test_client_limit() -> None:
+    async def main() -> None:
+        limiter = admission.Limiter(budget=0, queue_timeout=1.0, client_limit=1)
+        async with limiter.admit("a"):
+            with pytest.raises(admission.ClientLimitExceeded):
+                async with limiter.admit("a"):
+                    pass
+            async with limiter.admit("b"):
+                pass
+        async with limiter.admit("a"):
+            pass
+
+    asyncio.run(main())
+
+
+def test_spawn() -> None:
+    async def main() -> None:
+        limiter = admission.Limiter(budget=100, queue_timeout=1.0, client_limit=1)
+        done = asyncio.Event()
+        async with limiter.admit("a", 60) as ticket:
+            ticket.spawn(done.wait())
+        # The background task holds the budget and the client slot.
+        assert limiter.in_flight == 60
+        with pytest.raises(admission.ClientLimitExceeded):
+            async with limiter.admit("a"):
+                pass
+        done.set()
+        await limiter.drain()
+        assert limiter.in_flight == 0
+        async with limiter.admit("a"):
+            pass
+
+    asyncio.run(main())
+
+
+def test_resize() -> None:
+    async def main() -> None:
+        limiter = admission.Limiter(budget=100, queue_timeout=0.1, client_limit=0)
+        async with limiter.admit("a", 1000) as ticket:
+            # The estimate over the budget is admitted alone.
+            assert limiter.in_flight == 100
+            await ticket.resize(30)
+            assert limiter.in_flight == 30
+            async with limiter.admit("b", 70):
+                with pytest.raises(admission.Overloaded):
+                    await ticket.resize(40)
+            await ticket.resize(40)
+            assert limiter.in_flight == 40
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+import base64
+import threading
+
+import pytest
+
+from src import auth
+
+
+def basic(username: str, password: str) -> str:
+    return "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()
+
+
+def fast_hash(password: str) -> str:
+    return auth.hash_password(password, n=2**4)
+
+
+def test_hash_password() -> None:
+    encoded = fast_hash("secret")
+    assert encoded.startswith("scrypt$16$8$1$")
+    assert encoded != fast_hash("secret")
+    assert auth.verify_password("secret", encoded)
+    assert not auth.verify_password("Secret", encoded)
+
+    for malformed in ("scrypt$16$8$1$salt", "bcrypt$16$8$1$a$b", "scrypt$16$8$1$!!$!!"):
+        with pytest.raises(ValueError):  # noqa: PT011
+            auth.check_hash(malformed)
+
+
+def test_user_can_access() -> None:
+    user = auth.User("team-a", ("team-a/", "shared/"))
+    assert user.can_access("team-a/network")
+    assert user.can_access("shared/dns")
+    assert not user.can_access("team-b/network")
+    assert not user.is_admin
+    assert auth.User("admin", ("",)).is_admin
+
+
+class TestAuthenticator:
+    def make(self) -> auth.Authenticator:
+        return auth.Authenticator(
+            {"team-a": (fast_hash("secret"), ("team-a/",))}, cache_size=10, cache_ttl=60
+        )
+
+    def test_authenticate(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        authenticator = self.make()
+        header = basic("team-a", "secret")
+        assert authenticator.lookup(header) is None
+
+        user = authenticator.authenticate(header)
+        assert user == auth.User("team-a", ("team-a/",))
+
+        # The verified header is served from the cache.
+        monkeypatch.setattr(auth, "verify_password", None)
+        assert authenticator.lookup(header) == user
+        assert authenticator.authenticate(header) == user
+
+    @pytest.mark.parametrize(
+        ("header", "error"),
+        [
+            (None, auth.Unauthorized),
+            ("Bearer token", auth.Unauthorized),
+            ("Basic !!!", auth.Unauthorized),
+            (basic("team-a", "wrong"), auth.Forbidden),
+            (basic("unknown", "secret"), auth.Forbidden),
+        ],
+    )
+    def test_reject(self, header: str | None, error: type[auth.Error]) -> None:
+        authenticator = self.make()
+        with pytest.raises(error):
+            authenticator.authenticate(header)
+        assert authenticator.lookup(header) is None
+
+    def test_invalid_hash(self) -> None:
+        with pytest.raises(ValueError, match="team-a"):
+            auth.Authenticator({"team-a": ("plain", ("",))}, cache_size=10, cache_ttl=60)
+
+    @pytest.mark.parametrize("scheme", ["scrypt", "argon2"])
+    def test_reject_unknown(self, scheme: str, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Test the unknown users are verified with the configured schemes and parameters."""
+        if scheme == "argon2":
+            hasher = pytest.importorskip("argon2").PasswordHasher(time_cost=1, memory_cost=64)
+            hashes = [hasher.hash("secret")]
+        else:
+            hashes = [fast_hash("secret"), auth.hash_password("secret", n=2**5, r=4)]
+        users = {f"user-{i}": (h, ("",)) for i, h in enumerate(hashes)}
+        authenticator = auth.Authenticator(users, cache_size=10, cache_ttl=60)
+        verified = []
+        verify = auth.verify_password
+        monkeypatch.setattr(
+            auth, "verify_password", lambda *args: verified.append(args[1]) or verify(*args)
+        )
+
+        names = ["unknown", "unknown", *(f"unknown-{i}" for i in range(10))]
+        for i, name in enumerate(names):
+            with pytest.raises(auth.Forbidden):
+                authenticator.authenticate(basic(name, f"secret-{i}"))
+        assert verified[0] == verified[1]
+        assert {h.rsplit("$", 2)[0] for h in verified} <= {h.rsplit("$", 2)[0] for h in hashes}
+
+    def test_reject_cached(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        authenticator = self.make()
+        header = basic("team-a", "wrong")
+        with pytest.raises(auth.Forbidden):
+            authenticator.authenticate(header)
+
+        # The rejected header is not verified again.
+        monkeypatch.setattr(auth, "verify_password", None)
+        with pytest.raises(auth.Forbidden):
+            authenticator.authenticate(header)
+
+    def test_max_verifications(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        authenticator = auth.Authenticator(
+            {"team-a": (fast_hash("secret"), ("team-a/",))},
+            cache_size=10,
+            cache_ttl=60,
+            max_verifications=2,
+            queue_timeout=0.05,
+        )
+        started, release = threading.Semaphore(0), threading.Event()
+        verify = auth.verify_password
+
+        def slow_verify(password: str, encoded: str) -> bool:
+            started.release()
+            release.wait(10)
+            return verify(password, encoded)
+
+        monkeypatch.setattr(auth, "verify_password", slow_verify)
+        threads = [
+            threading.Thread(target=authenticator.authenticate, args=[basic("team-a", "secret")])
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            assert started.acquire(timeout=10)
+
+        # The verifications over the limit wait for their turn, then fail.
+        with pytest.raises(auth.Busy):
+            authenticator.authenticate(basic("team-a", "other"))
+        release.set()
+        for thread in threads:
+            thread.join()
+        with pytest.raises(auth.Forbidden):
+            authenticator.authenticate(basic("team-a", "other"))
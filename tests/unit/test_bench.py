@@ -0,0 +1,56 @@
+import orjson
+import pytest
+
+from src import bench
+from src import lock
+from src import storage
+
+
+def test_make_state() -> None:
+    for size in (64 * 1024, 1024**2):
+        body = bench.make_state(size, serial=3)
+        assert abs(len(body) - size) / size < 0.02
+        state = orjson.loads(body)
+        assert state["serial"] == 3
+        assert state["resources"][0]["type"] == "null_resource"
+
+
+def test_parse_size() -> None:
+    assert bench.parse_size("512") == 512
+    assert bench.parse_size("1KB") == 1024
+    assert bench.parse_size("100mb") == 100 * 1024**2
+    with pytest.raises(ValueError, match="Invalid size"):
+        bench.parse_size("1TB")
+
+
+def test_memory_backends() -> None:
+    backend = bench.MemoryStorageBackend()
+    backend.create("a", b"abc")
+    assert backend.get_range("a", 1, 5) == b"bc"
+    assert [obj.key for obj in backend.list_objects()] == ["a"]
+    backend.delete("a")
+    with pytest.raises(storage.NotFound):
+        backend.get("a")
+
+    locks = bench.MemoryLockBackend(backend)
+    locks.lock("a", {"id": "1"})
+    with pytest.raises(lock.AlreadyLocked):
+        locks.lock("a", {"id": "2"})
+    assert locks.unlock("a") == {"id": "1"}
+    with pytest.raises(lock.NotLocked):
+        locks.unlock("a")
+
+
+def test_run() -> None:
+    params = bench.Params(sizes=(4096,), requests=40, concurrency=4, latency=0, jitter=0)
+    default = storage.__dict__["default"]
+    results = bench.run(params)
+    # The default backends are restored.
+    assert storage.__dict__["default"] is default
+
+    [result] = results["results"]
+    assert result["errors"] == 0
+    assert result["requests"] >= params.requests
+    assert set(result["ops"]) <= {"get", "post", "lock", "unlock"}
+    assert result["ops"]["get"]["p50_ms"] <= result["ops"]["get"]["p99_ms"]
+    assert bench.compare(results, results)
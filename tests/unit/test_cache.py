@@ -0,0 +1,29 @@
+"""The unit tests for the in-process caches."""
+
+from src import cache
+
+
+def test_ttl_cache() -> None:
+    now = [0.0]
+    c: cache.TTLCache[str, int] = cache.TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1
+
+    now[0] = 10.0
+    assert c.get("a") is None
+    assert len(c) == 1
+
+    c.pop("c")
+    assert len(c) == 0
+
+    c.add("a", 1)
+    c.add("a", 2)
+    assert c.get("a") == 1
+    now[0] = 20.0
+    c.add("a", 3)
+    assert c.get("a") == 3
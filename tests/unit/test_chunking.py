@@ -0,0 +1,138 @@
+"""The unit tests for the content-defined chunking."""
+
+import hashlib
+import json
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+
+from src import chunking
+from src import storage
+
+
+def make_body(count: int, changed: int = -1) -> bytes:
+    resources = [
+        {
+            "type": "null_resource",
+            "name": f"dummy_{i}",
+            "instances": [
+                {
+                    "attributes": {
+                        "id": str(i * 7919),
+                        "triggers": {
+                            "run": "2" if i == changed else "1",
+                            "text": "Lorem ipsum " * 20,
+                        },
+                    }
+                }
+            ],
+        }
+        for i in range(count)
+    ]
+    return json.dumps({"version": 4, "serial": 1, "resources": resources}, indent=2).encode()
+
+
+def digests(data: bytes) -> set[str]:
+    return {hashlib.sha256(c).hexdigest() for c in chunking.split(data, 4096)}
+
+
+def test_split() -> None:
+    data = make_body(1000)
+    chunks = chunking.split(data, 4096)
+
+    assert b"".join(chunks) == data
+    assert all(1024 <= len(c) <= 16384 for c in chunks[:-1])
+    assert chunking.split(data, 4096) == chunks
+
+
+def test_split_minified() -> None:
+    data = json.dumps(json.loads(make_body(1000))).encode()
+    assert b"".join(chunking.split(data, 4096)) == data
+    assert len(chunking.split(data, 4096)) > 10
+
+
+def test_split_shift_resistant() -> None:
+    """Test only the chunks around the change differ."""
+    old, new = digests(make_body(1000)), digests(make_body(1000, changed=500))
+
+    assert len(new - old) <= 3
+    assert len(new & old) >= len(old) - 3
+
+
+def test_chunked_storage(fake_storage) -> None:
+    backend = storage.ChunkedStorageBackend(fake_storage, avg_size=4096)
+    body = make_body(1000)
+
+    backend.create("a", body)
+    assert backend.get("a") == body
+    assert fake_storage.objects["a"].startswith(backend.MANIFEST_MAGIC)
+    stored = len(fake_storage.objects)
+
+    backend.create("b", make_body(1000, changed=500))
+    assert backend.get("b") == make_body(1000, changed=500)
+    assert len(fake_storage.objects) - stored <= 4
+
+    backend.create("small", b"{}")
+    assert fake_storage.objects["small"] == b"{}"
+    assert backend.get("small") == b"{}"
+
+
+def test_chunked_storage_gc(fake_storage) -> None:
+    now = [datetime.now(UTC)]
+    fake_storage.clock = lambda: now[0]
+    backend = storage.ChunkedStorageBackend(
+        fake_storage, avg_size=4096, gc_grace=3600, clock=lambda: now[0]
+    )
+    backend.create("a", make_body(1000))
+    backend.create("b", make_body(1000, changed=500))
+    backend.create("small", b"{}")
+
+    # The new chunks are kept within the grace period.
+    assert backend.collect_garbage() == 0
+
+    now[0] += timedelta(hours=2)
+    backend.delete("b")
+    unreferenced = digests(make_body(1000, changed=500)) - digests(make_body(1000))
+    assert backend.collect_garbage() == len(unreferenced)
+    assert backend.get("a") == make_body(1000)
+
+    # The collected chunks are uploaded again.
+    backend.create("b", make_body(1000, changed=500))
+    assert backend.get("b") == make_body(1000, changed=500)
+
+    now[0] += timedelta(hours=2)
+    backend.delete("a")
+    backend.delete("b")
+    backend.collect_garbage()
+    assert list(fake_storage.objects) == ["small"]
+
+
+def test_chunked_storage_gc_workers(fake_storage) -> None:
+    now = [datetime.now(UTC)]
+    fake_storage.clock = lambda: now[0]
+    a, b = (
+        storage.ChunkedStorageBackend(
+            fake_storage, avg_size=4096, gc_grace=3600, clock=lambda: now[0]
+        )
+        for _ in range(2)
+    )
+    a.create("s", make_body(1000))
+    b.create("s", make_body(1000, changed=500))
+    now[0] += timedelta(hours=2)
+
+    # The chunk collected by the other worker is not trusted as stored.
+    assert b.collect_garbage() > 0
+    a.create("s", make_body(1000))
+    assert b.get("s") == make_body(1000)
+
+    # The reused chunks are refreshed, so they are not collected as unreferenced.
+    now[0] += timedelta(hours=2)
+    a.create("t", make_body(1000, changed=500))
+    a.delete("s")
+    b.collect_garbage()
+    assert a.get("t") == make_body(1000, changed=500)
+    assert all(
+        fake_storage.modified[key] == now[0]
+        for key in fake_storage.objects
+        if key.startswith(".chunks/")
+    )
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src import profiling
+
+
+def spin(stopped: threading.Event) -> None:
+    while not stopped.is_set():
+        sum(range(1000))
+
+
+def test_sample_stacks() -> None:
+    stopped = threading.Event()
+    thread = threading.Thread(target=spin, args=(stopped,), name="spinner")
+    thread.start()
+    try:
+        counts = profiling.sample_stacks(0.2, interval=0.005)
+    finally:
+        stopped.set()
+        thread.join()
+
+    spinner = {stack: n for stack, n in counts.items() if stack.startswith("spinner;")}
+    assert spinner
+    assert all("spin (tests.unit.test_profiling:" in stack for stack in spinner)
+    [line, *_] = profiling.collapse(spinner).splitlines()
+    stack, count = line.rsplit(" ", 1)
+    assert spinner[stack] == int(count)
+
+
+def test_busy() -> None:
+    started = threading.Event()
+
+    def profile() -> None:
+        started.set()
+        profiling.sample_stacks(0.2)
+
+    thread = threading.Thread(target=profile)
+    thread.start()
+    started.wait()
+    time.sleep(0.05)
+    with pytest.raises(profiling.Busy):
+        profiling.sample_stacks(0.1)
+    thread.join()
+
+
+def test_trace_allocations() -> None:
+    held = []
+    stopped = threading.Event()
+
+    def allocate() -> None:
+        while not stopped.wait(0.01):
+            held.append(bytearray(100_000))
+
+    thread = threading.Thread(target=allocate)
+    thread.start()
+    try:
+        allocations = profiling.trace_allocations(0.3, limit=5)
+    finally:
+        stopped.set()
+        thread.join()
+
+    [top, *_] = allocations
+    assert "test_profiling.py" in top.traceback[-1]
+    assert top.size_diff >= 100_000
+
+
+def test_monitor_loop() -> None:
+    def blocking_call() -> None:
+        time.sleep(0.3)
+
+    async def main() -> profiling.LoopReport:
+        async def block() -> None:
+            await asyncio.sleep(0.1)
+            blocking_call()
+
+        task = asyncio.create_task(block())
+        report = await profiling.monitor_loop(0.6, interval=0.01, threshold=0.1)
+        await task
+        return report
+
+    report = asyncio.run(main())
+    [slow] = report.slow_callbacks
+    assert slow.duration_ms >= 250
+    assert "blocking_call" in slow.stack[-1]
+    assert report.max_ms == slow.duration_ms
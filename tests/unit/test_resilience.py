@@ -0,0 +1,142 @@
+"""The unit tests for the backends resilience layer."""
+
+import threading
+import time
+
+import pytest
+
+from src import errors
+from src import resilience
+
+
+class Failure(errors.Error):
+    pass
+
+
+class Missing(Failure):
+    pass
+
+
+def make_guard(**kwargs) -> resilience.Guard:
+    policy = resilience.Policy(**{"backoff_base": 0.001, "hedge_quantile": 0, **kwargs})
+    return resilience.Guard("test", policy, failures=(Failure,), ignore=(Missing,))
+
+
+class TestCircuitBreaker:
+    def test_open_and_reset(self) -> None:
+        """Test the breaker opens after the threshold and lets a trial call through."""
+        now = [0.0]
+        breaker = resilience.CircuitBreaker(
+            "test", threshold=2, reset_timeout=10, clock=lambda: now[0]
+        )
+
+        breaker.record_failure()
+        breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == breaker.OPEN
+        with pytest.raises(resilience.CircuitOpen):
+            breaker.allow()
+
+        now[0] = 11.0
+        assert breaker.state == breaker.HALF_OPEN
+        breaker.allow()
+        with pytest.raises(resilience.CircuitOpen):
+            breaker.allow()
+
+        breaker.record_success()
+        assert breaker.state == breaker.CLOSED
+
+    def test_failed_trial(self) -> None:
+        """Test a failed trial call opens the breaker again."""
+        now = [0.0]
+        breaker = resilience.CircuitBreaker(
+            "test", threshold=1, reset_timeout=10, clock=lambda: now[0]
+        )
+        breaker.record_failure()
+
+        now[0] = 11.0
+        breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == breaker.OPEN
+
+
+class TestGuard:
+    def test_retry_idempotent(self) -> None:
+        """Test the idempotent calls are retried."""
+        calls = []
+
+        def fn() -> str:
+            calls.append(1)
+            if len(calls) < 3:
+                raise Failure("boom")
+            return "ok"
+
+        assert make_guard(retries=2).call(fn, idempotent=True) == "ok"
+        assert len(calls) == 3
+
+    def test_no_retry(self) -> None:
+        """Test the non-idempotent and ignored failures are not retried."""
+        calls = []
+
+        def fn(exc: type[Exception]) -> None:
+            calls.append(1)
+            raise exc("boom")
+
+        guard = make_guard(retries=2)
+        with pytest.raises(Failure):
+            guard.call(fn, Failure)
+        with pytest.raises(Missing):
+            guard.call(fn, Missing, idempotent=True)
+        assert len(calls) == 2
+
+    def test_deadline(self) -> None:
+        """Test the hung call fails after the deadline."""
+        release = threading.Event()
+        guard = make_guard(timeout=0.05)
+
+        with pytest.raises(resilience.DeadlineExceeded):
+            guard.call(release.wait, 5, idempotent=True)
+        release.set()
+
+    def test_fail_fast(self) -> None:
+        """Test the guard fails fast once the breaker is open."""
+        guard = make_guard(retries=0, breaker_threshold=1)
+
+        def fn() -> None:
+            raise Failure("boom")
+
+        with pytest.raises(Failure):
+            guard.call(fn)
+        with pytest.raises(resilience.CircuitOpen):
+            guard.call(fn)
+
+    def test_hedge(self) -> None:
+        """Test the slow call is hedged and the faster result wins."""
+        guard = make_guard(hedge_quantile=0.5, hedge_min_samples=1)
+        guard.latency(100).add(0.01)
+        calls = []
+
+        def fn() -> int:
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(1)
+            return len(calls)
+
+        started = time.monotonic()
+        assert guard.call(fn, hedge=True, size=100) == 2
+        assert time.monotonic() - started < 0.5
+
+    def test_hedge_by_size(self) -> None:
+        """Test the large call is not hedged by the latency of the small ones."""
+        guard = make_guard(hedge_quantile=0.5, hedge_min_samples=1)
+        guard.latency(100).add(0.01)
+        calls = []
+
+        def fn() -> int:
+            calls.append(1)
+            time.sleep(0.1)
+            return len(calls)
+
+        assert guard.call(fn, hedge=True, size=10 * 1024 * 1024) == 1
+        assert guard.call(fn, hedge=True) == 2
+        assert len(guard.latency(10 * 1024 * 1024)) == 1